@@ -139,6 +139,20 @@ else:
     }
 
 
+# Maximum memory used by each worker to cache the per ship edge costs used by route searches
+EDGE_COST_CACHE_BYTES = int(os.environ.get("EDGE_COST_CACHE_BYTES", 64 * 1024 * 1024))
+
+# How long browsers and proxies may reuse an autocomplete response without checking back
+AUTOCOMPLETE_CACHE_SECONDS = int(os.environ.get("AUTOCOMPLETE_CACHE_SECONDS", 60 * 60))
+
+# The largest number of route queries accepted by one request to the batch route api
+ROUTE_BATCH_MAX_QUERIES = int(os.environ.get("ROUTE_BATCH_MAX_QUERIES", 10000))
+
+# The number of worker processes each web worker uses to compute independent route legs and batch queries in
+# parallel. 0 computes everything in the web worker itself
+ROUTE_WORKER_PROCESSES = int(os.environ.get("ROUTE_WORKER_PROCESSES", 0))
+
+
 # Configure static files
 STATICFILES_FINDERS = ("django.contrib.staticfiles.finders.FileSystemFinder",)
 STATICFILES_DIRS = [
@@ -19,3 +19,12 @@ from django.core.cache.backends.memcached import BaseMemcachedCache
 BaseMemcachedCache.close = lambda self, **kwargs: None
 
 application = get_wsgi_application()
+
+# load the route graph while the app is imported, so that when gunicorn runs with --preload the graph is loaded
+# once in the master process and shared by every worker it forks. the database connection used to load it
+# must not be shared with the workers
+from maps import services
+from django.db import connections
+
+for connection in connections.all():
+    connection.close()
@@ -6,6 +6,8 @@ from static_dump.forms import (
     MultiSystemNameField,
     MultiRegionNameField,
     StationNameField,
+    get_name_resolver,
+    get_location_kind,
 )
 
 security_choices = [
@@ -38,18 +40,73 @@ waypoint_type_choices = [
 
 # a form where some fields are conditionally required
 class ConditionalForm(forms.Form):
+
+    # a field that isn't required cleans an empty value to None or to "", depending on the field, so both count
+    # as missing
     def validate_required_field(
         self, cleaned_data, field_name, message="This field is required"
     ):
 
         if (field_name not in self._errors) and (
-            cleaned_data.get(field_name, None) is None
+            cleaned_data.get(field_name, None) in (None, "")
         ):
             self._errors[field_name] = self.error_class(["This field is required"])
             cleaned_data.pop(field_name, None)
 
 
-class PathForm(ConditionalForm):
+# the route settings shared by every kind of route query: the systems to avoid and the ship being flown
+class RouteSettingsForm(ConditionalForm):
+    avoid_lowsec = forms.BooleanField(required=False)
+    maximum_security = forms.ChoiceField(
+        choices=security_choices, label="Avoid Security >"
+    )
+    avoid_systems = MultiSystemNameField(required=False, widget=forms.Textarea)
+    avoid_regions = MultiRegionNameField(required=False, widget=forms.Textarea)
+
+    compute_travel_time = forms.BooleanField(required=False)
+    autopilot = forms.BooleanField(required=False)
+    align_time = forms.FloatField(required=False, min_value=0.01, max_value=500)
+    warp_speed = forms.FloatField(required=False, min_value=0.01, max_value=500)
+    ship_speed = forms.FloatField(required=False, min_value=0.01, max_value=5000)
+
+    def clean_maximum_security(self):
+
+        value = self.cleaned_data["maximum_security"]
+        if value == "None" or value is None or len(value) == 0:
+            return None
+        else:
+            return float(value)
+
+    def clean(self):
+        cleaned_data = super(RouteSettingsForm, self).clean()
+
+        if cleaned_data.get("compute_travel_time", False):
+            self.validate_required_field(cleaned_data, "align_time")
+            self.validate_required_field(cleaned_data, "warp_speed")
+            self.validate_required_field(cleaned_data, "ship_speed")
+
+        # attach the ids of the avoided systems, so the route services don't have to look the names up again
+        resolver = get_name_resolver()
+        avoided_systems = set()
+        if cleaned_data.get("avoid_systems"):
+            system_ids, not_found = resolver.get_ids(
+                "system", cleaned_data["avoid_systems"]
+            )
+            avoided_systems.update(system_ids)
+
+        if cleaned_data.get("avoid_regions"):
+            region_ids, not_found = resolver.get_ids(
+                "region", cleaned_data["avoid_regions"]
+            )
+            for region_id in region_ids:
+                avoided_systems.update(resolver.get_region_systems(region_id))
+
+        cleaned_data["avoided_system_ids"] = avoided_systems
+
+        return cleaned_data
+
+
+class PathForm(RouteSettingsForm):
     origin_type = forms.ChoiceField(
         widget=forms.RadioSelect,
         choices=origin_type_choices,
@@ -74,30 +131,9 @@ class PathForm(ConditionalForm):
     use_midpoints = forms.BooleanField(required=False)
     optimize_midpoints = forms.BooleanField(required=False)
 
-    avoid_lowsec = forms.BooleanField(required=False)
-    maximum_security = forms.ChoiceField(
-        choices=security_choices, label="Avoid Security >"
-    )
-    avoid_systems = MultiSystemNameField(required=False, widget=forms.Textarea)
-    avoid_regions = MultiRegionNameField(required=False, widget=forms.Textarea)
-
-    compute_travel_time = forms.BooleanField(required=False)
-    autopilot = forms.BooleanField(required=False)
-    align_time = forms.FloatField(required=False, min_value=0.01, max_value=500)
-    warp_speed = forms.FloatField(required=False, min_value=0.01, max_value=500)
-    ship_speed = forms.FloatField(required=False, min_value=0.01, max_value=5000)
-
     def __init__(self, *args, **kwargs):
         super(PathForm, self).__init__(*args, **kwargs)
 
-    def clean_maximum_security(self):
-
-        value = self.cleaned_data["maximum_security"]
-        if value == "None" or value is None or len(value) == 0:
-            return None
-        else:
-            return float(value)
-
     def clean(self):
         cleaned_data = super(PathForm, self).clean()
 
@@ -116,10 +152,53 @@ class PathForm(ConditionalForm):
             else:
                 self.validate_required_field(cleaned_data, dest_type)
 
-        if cleaned_data.get("compute_travel_time", False):
-            self.validate_required_field(cleaned_data, "align_time")
-            self.validate_required_field(cleaned_data, "warp_speed")
-            self.validate_required_field(cleaned_data, "ship_speed")
+        # attach the ids of the chosen locations, so the route services don't have to look the names up again
+        resolver = get_name_resolver()
+        for type_field, id_field in (
+            ("origin_type", "origin_id"),
+            ("destination_type", "destination_id"),
+        ):
+            field_name = cleaned_data.get(type_field)
+            if cleaned_data.get(field_name):
+                cleaned_data[id_field] = resolver.get_id(
+                    get_location_kind(field_name), cleaned_data[field_name]
+                )
+
+        return cleaned_data
+
+
+# a query for every system within a jump or travel time limit of an origin
+class RangeForm(RouteSettingsForm):
+    origin_type = forms.ChoiceField(
+        widget=forms.RadioSelect,
+        choices=origin_type_choices,
+        initial="origin_system",
+        label="Origin",
+    )
+
+    origin_system = SystemNameField(required=False)
+    origin_station = StationNameField(required=False)
+
+    max_jumps = forms.IntegerField(required=False, min_value=0)
+    max_time = forms.FloatField(required=False, min_value=0)
+
+    def clean(self):
+        cleaned_data = super(RangeForm, self).clean()
+
+        if "origin_type" in cleaned_data:
+            field_name = cleaned_data["origin_type"]
+            self.validate_required_field(cleaned_data, field_name)
+
+            if cleaned_data.get(field_name):
+                cleaned_data["origin_id"] = get_name_resolver().get_id(
+                    get_location_kind(field_name), cleaned_data[field_name]
+                )
+
+        if "max_jumps" not in self._errors and "max_time" not in self._errors:
+            if (cleaned_data.get("max_jumps") is None) == (
+                cleaned_data.get("max_time") is None
+            ):
+                self.add_error(None, "Either a jump or a travel time limit is required")
 
         return cleaned_data
 
@@ -143,4 +222,9 @@ class WaypointForm(ConditionalForm):
             field_name = cleaned_data["destination_type"]
             self.validate_required_field(cleaned_data, field_name)
 
+            if cleaned_data.get(field_name):
+                cleaned_data["destination_id"] = get_name_resolver().get_id(
+                    get_location_kind(field_name), cleaned_data[field_name]
+                )
+
         return cleaned_data
@@ -1,21 +1,147 @@
-import math
+import itertools
+import multiprocessing
 import sqlite3
+import time
+from collections import namedtuple
 
 from django.db import transaction
 from django.core.management.base import LabelCommand
 
+from static_dump import dump_manager
 from static_dump.models import *
 
-import networkx
-import progressbar
+import numpy
+from scipy.spatial import distance
+
+from math_utils.union_find import UnionFind
+
+# rows are matched on their primary key, except for edges, which are matched on the nodes they connect
+table_keys = {GraphEdge: ["origin_id", "destination_id"]}
+
+# recomputed distances may differ in the last few bits, which shouldn't count as a change
+distance_tolerance = 1e-9
+
+# the differences between the dump and one imported table. inserted is a list of unsaved model instances,
+# updated is a list of (primary key, old values, new values) and deleted is a list of (primary key, old values)
+TableChanges = namedtuple("TableChanges", ["inserted", "updated", "deleted"])
+
+# systems are handed to the worker processes in chunks of this many, to keep the messaging overhead low
+distance_chunk_size = 64
+
+
+# returns the distance between every pair of positions, in the condensed order used by scipy's pdist:
+# (0, 1), (0, 2), ... (0, n - 1), (1, 2), ... this runs in the worker processes, so it must stay at module level
+def compute_system_distances(positions):
+    return distance.pdist(positions)
 
 
 class Command(LabelCommand):
     help = "Given the filename of an eve online static dump in sqlite format, import the solar system data for use by the application"
 
-    @transaction.atomic
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+
+        parser.add_argument(
+            "--landmarks",
+            type=int,
+            default=16,
+            help="Number of landmarks to precompute route costs for",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="Number of rows to insert with each bulk insert",
+        )
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            help="Compare the dump with the imported map and only apply the differences",
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=None,
+            help="Number of processes used to compute distances, defaults to the number of cpus",
+        )
+
     def handle_label(self, label, **options):
-        self.import_data(label)
+        changes = None
+
+        with transaction.atomic():
+            if options["incremental"]:
+                changes = self.import_changes(
+                    label, options["batch_size"], options["processes"]
+                )
+            else:
+                self.import_data(label, options["batch_size"], options["processes"])
+
+        if changes is not None and not any(
+            table_changes.inserted or table_changes.updated or table_changes.deleted
+            for table_changes in changes.values()
+        ):
+            print("The imported map is already up to date")
+            return
+
+        # a new version invalidates every cached route computed from the previous dump
+        dump_manager.write_dump_version()
+
+        self.build_route_indexes(options, changes)
+
+    # precompute the route indexes stored next to the database. this has to run after the import has been
+    # committed and the new version written, and it uses a gate warp manager loaded at that point. the manager
+    # shared by the route services was loaded before the import, when django ran its system checks, so it
+    # still holds the old graph
+    # after an incremental import, changes holds the TableChanges for each model and only the indexes that
+    # depend on the changed tables are rebuilt. indexes that are left alone were built for the same nodes
+    # and systems, so they are still loaded for the new dump version
+    def build_route_indexes(self, options, changes=None):
+        from maps import services
+
+        gate_manager = dump_manager.GateWarpManager()
+
+        # the snapshot holds names and security levels too, so it is written for every new version
+        print("Writing graph snapshot")
+        gate_manager.write_snapshot()
+
+        if changes is None or self.has_jump_changes(changes):
+            print("Building jump matrix")
+            gate_manager.build_jump_matrix()
+
+        # the hierarchy is checked against the dump version when it is loaded, so it is rebuilt for every import
+        print("Building system contraction hierarchy")
+        gate_manager.build_system_hierarchy()
+
+        # the lower bounds on the edge costs only depend on the nodes and edges
+        if changes is None or self.has_graph_changes(changes):
+            print("Building landmark index")
+            services.build_landmark_index(gate_manager, options["landmarks"])
+
+    # returns True if the changes alter the graph of nodes and edges
+    def has_graph_changes(self, changes):
+        return any(
+            table_changes.inserted or table_changes.updated or table_changes.deleted
+            for table_changes in (changes[GraphNode], changes[GraphEdge])
+        )
+
+    # returns True if the changes alter which systems exist or how they are connected by gates
+    def has_jump_changes(self, changes):
+        if (
+            changes[MapSolarSystem].inserted
+            or changes[MapSolarSystem].deleted
+            or changes[GraphNode].updated
+        ):
+            return True
+
+        edge_changes = changes[GraphEdge]
+        return (
+            any(edge.distance is None for edge in edge_changes.inserted)
+            or any(
+                old_values[0] is None or new_values[0] is None
+                for (pk, old_values, new_values) in edge_changes.updated
+            )
+            or any(old_values[0] is None for (pk, old_values) in edge_changes.deleted)
+        )
 
     def create_temp_collections(self):
         # create a collection to store regions, for use by the autocomplete ajax
@@ -49,7 +175,139 @@ class Command(LabelCommand):
         # when an edge goes between two "ends" of a gate, the distance is None
         db.create_collection("dev_map_edge")
 
-    def import_data(self, filename):
+    # inserts the model instances produced by the rows iterable in batches, so that only one batch is held in
+    # memory at a time, and reports the insert rate as it goes. returns the number of rows inserted
+    def bulk_insert(self, model, rows, batch_size):
+        rows = iter(rows)
+        count = 0
+        start_time = time.time()
+
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if len(batch) == 0:
+                break
+
+            model.objects.bulk_create(batch)
+            count += len(batch)
+
+            elapsed = max(time.time() - start_time, 1e-6)
+            print(
+                "\r%s: %d rows (%.0f rows/s)"
+                % (model.__name__, count, count / elapsed),
+                end="",
+                flush=True,
+            )
+
+        print()
+        return count
+
+    def import_data(self, filename, batch_size, processes):
+        for (model, rows) in self.read_dump(filename, processes):
+            print("Inserting %s" % model._meta.verbose_name_plural)
+            self.bulk_insert(model, rows, batch_size)
+
+    # compares the dump with the imported map and applies only the inserts, updates and deletes needed to make
+    # them match. prints a summary of the changes and returns a dict mapping each model to its TableChanges
+    def import_changes(self, filename, batch_size, processes):
+        tables = self.read_dump(filename, processes)
+
+        changes = dict()
+        for (model, rows) in tables:
+            print("Comparing %s" % model._meta.verbose_name_plural)
+            changes[model] = self.compare_table(model, rows)
+
+        # delete before inserting, so that a name moving to a new row doesn't clash with the row it replaces.
+        # dependent tables come later in the list, so their rows are deleted first
+        for (model, rows) in reversed(tables):
+            deleted_keys = [pk for (pk, old_values) in changes[model].deleted]
+
+            for start in range(0, len(deleted_keys), batch_size):
+                model.objects.filter(
+                    pk__in=deleted_keys[start : start + batch_size]
+                ).delete()
+
+        for (model, rows) in tables:
+            table_changes = changes[model]
+            value_fields = self.get_value_fields(model)
+
+            self.bulk_insert(model, table_changes.inserted, batch_size)
+
+            for (pk, old_values, new_values) in table_changes.updated:
+                model.objects.filter(pk=pk).update(
+                    **dict(zip(value_fields, new_values))
+                )
+
+        print("Changes:")
+        for (model, rows) in tables:
+            table_changes = changes[model]
+            print(
+                "  %s: %d inserted, %d updated, %d deleted"
+                % (
+                    model._meta.verbose_name_plural,
+                    len(table_changes.inserted),
+                    len(table_changes.updated),
+                    len(table_changes.deleted),
+                )
+            )
+
+        return changes
+
+    # compares the rows from the dump with the rows of the imported table, and returns their TableChanges
+    def compare_table(self, model, rows):
+        key_fields = table_keys.get(model, ["id"])
+        value_fields = self.get_value_fields(model)
+
+        # map from each existing row's key to its primary key and values
+        existing = dict()
+        for values in model.objects.values_list(
+            "pk", *(key_fields + value_fields)
+        ).iterator():
+            existing[values[1 : len(key_fields) + 1]] = (
+                values[0],
+                values[len(key_fields) + 1 :],
+            )
+
+        inserted = []
+        updated = []
+        for instance in rows:
+            key = tuple(getattr(instance, field) for field in key_fields)
+            new_values = tuple(getattr(instance, field) for field in value_fields)
+            old_row = existing.pop(key, None)
+
+            if old_row is None:
+                inserted.append(instance)
+            elif not self.values_match(old_row[1], new_values):
+                updated.append((old_row[0], old_row[1], new_values))
+
+        # whatever is left over is no longer in the dump
+        deleted = list(existing.values())
+
+        return TableChanges(inserted, updated, deleted)
+
+    # returns the names of the fields compared by the incremental import, other than the key fields
+    def get_value_fields(self, model):
+        key_fields = table_keys.get(model, ["id"])
+        return [
+            field.attname
+            for field in model._meta.concrete_fields
+            if not field.primary_key and field.attname not in key_fields
+        ]
+
+    # compares two tuples of field values, allowing floats to differ by a tiny relative amount
+    def values_match(self, old_values, new_values):
+        for (old, new) in zip(old_values, new_values):
+            if isinstance(old, float) and isinstance(new, float):
+                if abs(old - new) > distance_tolerance * max(abs(old), abs(new)):
+                    return False
+            elif old != new:
+                return False
+
+        return True
+
+    # reads the static dump and returns a list of (model, rows) tuples, where rows is an iterable of unsaved
+    # model instances. tables are listed in the order they can be filled in without breaking foreign keys, and
+    # each iterable reads from the dump as it goes, so they have to be consumed one at a time in order
+    def read_dump(self, filename, processes):
         con = sqlite3.connect(filename)
         con.row_factory = sqlite3.Row
         cursor = con.cursor()
@@ -92,102 +350,138 @@ class Command(LabelCommand):
             }
             systems[row["solarSystemID"]]["objects"].append(station_entry)
 
-        # create a networkx graph to store the data in
-        map_graph = networkx.Graph()
-
-        # first add all the nodes
-        print("Generating nodes")
-        for system_id, system_data in systems.items():
-
-            for item in system_data["objects"]:
-                map_graph.add_node(
-                    item["denormalize_id"],
-                    system_id=system_id,
-                    security=system_data["security"],
+        # compute the distances within each system in parallel. every object in a system is connected to every
+        # other object, so only the systems with at least two objects have any distances to compute
+        print("Computing distances")
+        distance_systems = [
+            system_id
+            for (system_id, system_data) in systems.items()
+            if len(system_data["objects"]) > 1
+        ]
+
+        def generate_positions():
+            for system_id in distance_systems:
+                yield numpy.array(
+                    [item["position"] for item in systems[system_id]["objects"]],
+                    dtype=numpy.float64,
                 )
 
-        # add edges
-        print("Generating edges")
-        for system_id, system_data in systems.items():
+        with multiprocessing.Pool(processes) as pool:
+            distances = pool.imap(
+                compute_system_distances, generate_positions(), distance_chunk_size
+            )
+            system_distances = dict(zip(distance_systems, distances))
 
+        # each gate is listed once from each side, so keep one entry for every pair of connected gates
+        gate_pairs = set()
+        node_systems = dict()
+        for system_id, system_data in systems.items():
             for item in system_data["objects"]:
+                a = item["denormalize_id"]
+                b = item["destination_denormalize_id"]
+                node_systems[a] = system_id
 
-                # if destination is not None, this is a gate, so create an edge from this "side" of the gate to the other "side"
-                # make the distance None, because didtance doesn't really make sense here
-                if item["destination_denormalize_id"] is not None:
-                    map_graph.add_edge(
-                        item["denormalize_id"],
-                        item["destination_denormalize_id"],
-                        distance=None,
-                    )
-
-                # make an edge from this item to every other item in this system
-                for other in system_data["objects"]:
-                    if item != other:
-
-                        # compute the distance from 'item' to 'other'
-                        px, py, pz = item["position"]
-                        nx, ny, nz = other["position"]
+                if b is not None:
+                    gate_pairs.add((min(a, b), max(a, b)))
 
-                        dx = px - nx
-                        dy = py - ny
-                        dz = pz - nz
-
-                        distance = math.sqrt(dx * dx + dy * dy + dz * dz)
-
-                        map_graph.add_edge(
-                            item["denormalize_id"],
-                            other["denormalize_id"],
-                            distance=distance,
-                        )
+        # gates leading to objects outside the dump's systems can't be used
+        gate_pairs = {
+            (a, b) for (a, b) in gate_pairs if a in node_systems and b in node_systems
+        }
 
-        # find the largest connected subgraph. this will weed out the wormhole systems and jove regions
+        # the components only depend on which objects are connected, not on the distances, so a chain through
+        # the objects of each system stands in for the full set of edges between them
         print("Removing unconnected components")
-        main_map = list(networkx.connected_component_subgraphs(map_graph))[0]
+        node_ids = sorted(node_systems)
+        node_index = {node_id: index for index, node_id in enumerate(node_ids)}
+
+        node_sets = UnionFind(len(node_ids))
+        for system_data in systems.values():
+            object_indices = [
+                node_index[item["denormalize_id"]] for item in system_data["objects"]
+            ]
+            for (a, b) in zip(object_indices, object_indices[1:]):
+                node_sets.union(a, b)
+
+        for (a, b) in gate_pairs:
+            node_sets.union(node_index[a], node_index[b])
+
+        # keep the largest connected component. this will weed out the wormhole systems and jove regions
+        node_roots = node_sets.roots()
+        roots, sizes = numpy.unique(node_roots, return_counts=True)
+        order = numpy.argsort(-sizes, kind="mergesort")
+        roots, sizes = roots[order], sizes[order]
+        connected_nodes = {
+            node_ids[index]
+            for index in numpy.flatnonzero(node_roots == roots[0]).tolist()
+        }
 
         # keep a set to keep track of which systems are in our connected component
-        connected_systems = set()
-
-        # insert the nodes from main_map into the database
-
-        print("Inserting nodes and edges")
-        with progressbar.ProgressBar(max_value=len(main_map.nodes())) as bar:
-            for i, (node_id, data) in enumerate(main_map.nodes_iter(data=True)):
-                bar.update(i)
-
-                connected_systems.add(data["system_id"])
-                GraphNode.objects.create(id=node_id, system_id=data["system_id"])
+        connected_systems = {node_systems[node_id] for node_id in connected_nodes}
+
+        print(
+            "Kept %d of %d nodes. Discarded %d components with %d nodes in %d systems, the largest with %d nodes"
+            % (
+                len(connected_nodes),
+                len(node_ids),
+                len(roots) - 1,
+                len(node_ids) - len(connected_nodes),
+                len(set(node_systems.values()) - connected_systems),
+                sizes[1] if len(sizes) > 1 else 0,
+            )
+        )
 
-                # build the edge document for this node too
-                edge_document = {}
-                for neighbor_id, data in main_map[node_id].items():
-                    GraphEdge.objects.create(
-                        origin_id=node_id,
-                        destination_id=neighbor_id,
-                        distance=data["distance"],
-                    )
+        system_rows = [
+            row
+            for row in cursor.execute(
+                """
+                    SELECT 
+                        s.solarSystemID AS system_id, s.solarSystemName AS name, s.security AS security,
+                        s.constellationID AS constellation_id, 
+                        s.regionID AS region_id
+                    FROM mapsolarsystems AS s 
+                    JOIN mapconstellations AS c ON s.constellationID = c.constellationID
+                    JOIN mapregions AS r ON s.regionID = r.regionID
+                    """
+            )
+            if row["system_id"] in connected_systems
+        ]
 
         # we need to gather a list of non wormhole and non jove regions
-        connected_regions = set()
-        connected_constellations = set()
+        connected_regions = {row["region_id"] for row in system_rows}
+        connected_constellations = {row["constellation_id"] for row in system_rows}
 
-        print("Inserting systems")
-        for row in cursor.execute(
-            """
-                SELECT 
-                    s.solarSystemID AS system_id, s.solarSystemName AS name, s.security AS security,
-                    s.constellationID AS constellation_id, 
-                    s.regionID AS region_id
-                FROM mapsolarsystems AS s 
-                JOIN mapconstellations AS c ON s.constellationID = c.constellationID
-                JOIN mapregions AS r ON s.regionID = r.regionID
+        def generate_regions():
+            for row in cursor.execute(
                 """
-        ):
-            if row["system_id"] in connected_systems:
-                connected_regions.add(row["region_id"])
-                connected_constellations.add(row["constellation_id"])
+                    SELECT 
+                        r.regionID AS region_id, r.regionName AS name
+                    FROM mapregions AS r
+                    """
+            ):
+                if row["region_id"] in connected_regions:
+                    yield MapRegion(id=row["region_id"], name=row["name"])
+
+        def generate_constellations():
+            for row in cursor.execute(
+                """
+                    SELECT 
+                        c.constellationID AS contellation_id, c.constellationName AS name, 
+                        c.regionID AS region_id, r.regionName AS region_name
+                    FROM mapconstellations AS c 
+                    JOIN mapregions AS r ON c.regionID = r.regionID
+                    """
+            ):
+                if row["contellation_id"] in connected_constellations:
+                    yield MapConstellation(
+                        id=row["contellation_id"],
+                        region_id=row["region_id"],
+                        name=row["name"],
+                    )
 
-                MapSolarSystem.objects.create(
+        def generate_systems():
+            for row in system_rows:
+                yield MapSolarSystem(
                     id=row["system_id"],
                     region_id=row["region_id"],
                     constellation_id=row["constellation_id"],
@@ -195,44 +489,56 @@ class Command(LabelCommand):
                     security_level=row["security"],
                 )
 
-        print("Inserting constellations")
-        for row in cursor.execute(
-            """
-                SELECT 
-                    c.constellationID AS contellation_id, c.constellationName AS name, 
-                    c.regionID AS region_id, r.regionName AS region_name
-                FROM mapconstellations AS c 
-                JOIN mapregions AS r ON c.regionID = r.regionID
-                """
-        ):
-            if row["contellation_id"] in connected_constellations:
-                MapConstellation.objects.create(
-                    id=row["contellation_id"],
-                    region_id=row["region_id"],
-                    name=row["name"],
-                )
+        def generate_nodes():
+            for node_id in sorted(connected_nodes):
+                yield GraphNode(id=node_id, system_id=node_systems[node_id])
 
-        print("Inserting constellations")
-        for row in cursor.execute(
-            """
-                SELECT 
-                    r.regionID AS region_id, r.regionName AS name
-                FROM mapregions AS r
-                """
-        ):
-            if row["region_id"] in connected_regions:
-                MapRegion.objects.create(id=row["region_id"], name=row["name"])
+        # every edge is stored once in each direction
+        def generate_edges():
 
-        print("Inserting stations")
-        for row in cursor.execute(
-            "SELECT stationID, stationName, solarSystemID FROM stastations"
-        ):
-            if row["solarSystemID"] in connected_systems:
-                Station.objects.create(
-                    id=row["stationID"],
-                    system_id=row["solarSystemID"],
-                    name=row["stationName"],
+            # the edge between the two sides of a gate has no distance
+            for (a, b) in gate_pairs:
+                if a in connected_nodes:
+                    yield GraphEdge(origin_id=a, destination_id=b, distance=None)
+                    yield GraphEdge(origin_id=b, destination_id=a, distance=None)
+
+            for (system_id, distances) in system_distances.items():
+                if system_id not in connected_systems:
+                    continue
+
+                object_ids = numpy.array(
+                    [item["denormalize_id"] for item in systems[system_id]["objects"]],
+                    dtype=numpy.int64,
                 )
+                origins, targets = numpy.triu_indices(len(object_ids), 1)
+
+                for (a, b, d) in zip(
+                    object_ids[origins].tolist(),
+                    object_ids[targets].tolist(),
+                    distances.tolist(),
+                ):
+                    yield GraphEdge(origin_id=a, destination_id=b, distance=d)
+                    yield GraphEdge(origin_id=b, destination_id=a, distance=d)
+
+        def generate_stations():
+            for row in cursor.execute(
+                "SELECT stationID, stationName, solarSystemID FROM stastations"
+            ):
+                if row["solarSystemID"] in connected_systems:
+                    yield Station(
+                        id=row["stationID"],
+                        system_id=row["solarSystemID"],
+                        name=row["stationName"],
+                    )
+
+        return [
+            (MapRegion, generate_regions()),
+            (MapConstellation, generate_constellations()),
+            (MapSolarSystem, generate_systems()),
+            (GraphNode, generate_nodes()),
+            (GraphEdge, generate_edges()),
+            (Station, generate_stations()),
+        ]
 
     def save_temp_collections(self):
         db.dev_region.rename("region", dropTarget=True)
@@ -1,148 +1,213 @@
-from static_dump.models import MapSolarSystem, MapRegion, Station, GraphNode
+import functools
+import hashlib
+import json
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy
+from django.conf import settings
+from django.core.cache import cache
 
 from static_dump import dump_manager
 from math_utils import travel_time
 from math_utils import search
+from math_utils import tour
+from static_dump.forms import get_location_kind
 
 one_au = 150000000000
-gate_manager = dump_manager.GateWarpManager()
+jump_time = 10  # 10 seconds to jump from one system to another
+
+# the ship used when travel time isn't being computed
+default_warp_speed = one_au * 3
+default_ship_speed = 150
+default_align_time = 5
+
+# the name shown for each kind of route stop
+stop_type_names = {
+    "destination_region": "Region",
+    "destination_station": "Station",
+    "destination_system": "System",
+}
+
+gate_manager = dump_manager.get_gate_manager()
 
 
 def get_origin_states(data_dict):
+    return get_location_states(data_dict["origin_type"], get_origin_id(data_dict))
 
-    origin_type = data_dict["origin_type"]
 
-    if origin_type == "origin_system":
-        return set(
-            GraphNode.objects.filter(
-                system__name=data_dict["origin_system"]
-            ).values_list("id", flat=True)
-        )
+# returns the id of the origin. a validated path form carries the id, otherwise the name is resolved
+def get_origin_id(data_dict):
+    if data_dict.get("origin_id") is not None:
+        return data_dict["origin_id"]
 
-    elif origin_type == "origin_station":
-        return {
-            Station.objects.values_list("id", flat=True).get(
-                name=data_dict["origin_station"]
-            )
-        }
+    return get_location_id(
+        data_dict["origin_type"], data_dict[data_dict["origin_type"]]
+    )
 
-    else:
-        raise ValueError("Invalid origin type")
 
+# returns the id of the final destination, in the same way as get_origin_id
+def get_destination_id(data_dict):
+    if data_dict.get("destination_id") is not None:
+        return data_dict["destination_id"]
 
-def get_destination_states(data_dict):
-    destination_type = data_dict["destination_type"]
+    return get_location_id(
+        data_dict["destination_type"], data_dict[data_dict["destination_type"]]
+    )
 
-    if destination_type == "destination_system":
-        return set(
-            GraphNode.objects.filter(
-                system__name=data_dict["destination_system"]
-            ).values_list("id", flat=True)
-        )
 
-    elif destination_type == "destination_station":
-        return {
-            Station.objects.values_list("id", flat=True).get(
-                name=data_dict["destination_station"]
-            )
-        }
+# returns the id of the named location. location_type is the name of the form field holding it, such as
+# origin_system or destination_region
+def get_location_id(location_type, name):
+    location_id = gate_manager.get_name_resolver().get_id(
+        get_location_kind(location_type), name
+    )
 
-    elif destination_type == "destination_region":
-        return set(
-            GraphNode.objects.filter(
-                system__region__name=data_dict["destination_region"]
-            ).values_list("id", flat=True)
-        )
+    if location_id is None:
+        raise ValueError("Unknown location '%s'" % name)
+
+    return location_id
+
+
+# returns the set of states at the location with the given type and id
+def get_location_states(location_type, location_id):
+    kind = get_location_kind(location_type)
+
+    if kind == "system":
+        return set(gate_manager.get_system_nodes(location_id))
+
+    elif kind == "station":
+        return {location_id}
+
+    elif kind == "region":
+        resolver = gate_manager.get_name_resolver()
+
+        states = set()
+        for system_id in resolver.get_region_systems(location_id):
+            states.update(gate_manager.get_system_nodes(system_id))
+
+        return states
 
     else:
-        raise ValueError("Invalid destination type")
+        raise ValueError("Invalid location type")
 
 
+# returns the set of system ids to avoid. a validated path form carries the ids, otherwise the avoid fields
+# hold comma separated lists of system and region names
 def get_avoided_systems(data_dict):
-    avoided_systems = set(data_dict["avoid_systems"])
-    avoided_regions = data_dict["avoid_regions"]
+    if data_dict.get("avoided_system_ids") is not None:
+        return set(data_dict["avoided_system_ids"])
 
-    return avoided_systems | set(
-        MapSolarSystem.objects.filter(region_id__in=avoided_regions).values_list(
-            "id", flat=True
-        )
-    )
+    resolver = gate_manager.get_name_resolver()
+    avoided_systems = set()
+
+    if data_dict["avoid_systems"]:
+        system_ids, not_found = resolver.get_ids("system", data_dict["avoid_systems"])
+        avoided_systems.update(system_ids)
+
+    if data_dict["avoid_regions"]:
+        region_ids, not_found = resolver.get_ids("region", data_dict["avoid_regions"])
+        for region_id in region_ids:
+            avoided_systems.update(resolver.get_region_systems(region_id))
+
+    return avoided_systems
 
 
+# computes the travel path for the cleaned path form data, reusing a cached result for an identical query
 def compute_travel_path(data_dict):
+    cache_key = get_route_cache_key(data_dict)
+
+    result = cache.get(cache_key)
+    if result is None:
+        result = compute_uncached_travel_path(data_dict)
+        cache.set(cache_key, result)
+
+    return result
+
+
+# returns the route cache key for the cleaned path form data. only the fields that can change the result are
+# included, and the static dump version is part of the key so that importing a new dump invalidates old routes
+def get_route_cache_key(data_dict):
+    query = {
+        "origin": [data_dict["origin_type"], data_dict[data_dict["origin_type"]]],
+        "destination": [
+            data_dict["destination_type"],
+            data_dict[data_dict["destination_type"]],
+        ],
+        "avoid_lowsec": data_dict["avoid_lowsec"],
+        "maximum_security": data_dict["maximum_security"],
+        "avoid_systems": data_dict["avoid_systems"],
+        "avoid_regions": data_dict["avoid_regions"],
+        "autopilot": data_dict["autopilot"],
+        "compute_travel_time": data_dict["compute_travel_time"],
+    }
 
-    total_path = []
+    if data_dict["use_midpoints"]:
+        query["waypoints"] = [
+            [waypoint["type"], waypoint["name"]]
+            for waypoint in data_dict["waypoint_list"]
+        ]
+        query["optimize_midpoints"] = data_dict["optimize_midpoints"]
 
-    origin_states = get_origin_states(data_dict)
+    if data_dict["compute_travel_time"]:
+        query["ship"] = [
+            data_dict["align_time"],
+            data_dict["warp_speed"],
+            data_dict["ship_speed"],
+        ]
 
-    if data_dict["use_midpoints"] and len(data_dict["waypoint_list"]) > 0:
+    digest = hashlib.sha1(
+        json.dumps(query, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    ).hexdigest()
 
-        result_path = []
+    return "route:%s:%s" % (gate_manager.get_version(), digest)
+
+
+def compute_uncached_travel_path(data_dict):
+
+    origin_states = get_origin_states(data_dict)
 
-        # the user has selected multiple waypoints, so we need to travel down the list
-        for destination in data_dict["waypoint_list"]:
-            waypoint_dict = {"destination_type": destination["type"]}
+    use_waypoints = data_dict["use_midpoints"] and len(data_dict["waypoint_list"]) > 0
 
-            # the get_destination_states method is expecting a dictionary key with the same name as the value of destination_type
-            waypoint_dict[destination["type"]] = destination["name"]
+    # with several legs, trade routes tend to pass through the same places more than once, so keep the search
+    # trees around for the legs that start from somewhere that has already been searched
+    session = RouteSession(data_dict, keep_trees=use_waypoints)
 
-            destination_states = get_destination_states(waypoint_dict)
+    # the stops on the route as (type, id, name) tuples, finishing with the destination
+    stops = []
 
-            waypoint_list, waypoint_time, waypoint_error = compute_waypoint_path(
-                origin_states, destination_states, data_dict
+    if use_waypoints:
+        waypoints = data_dict["waypoint_list"]
+
+        if data_dict["optimize_midpoints"]:
+            waypoints = optimize_waypoint_order(
+                session, origin_states, waypoints, data_dict
             )
 
-            if len(waypoint_list) == 0:
-                break
-
-            # determine the name of the waypoint for display purposes
-            if destination["type"] == "destination_region":
-                type_name = "Region"
-            elif destination["type"] == "destination_station":
-                type_name = "Station"
-            elif destination["type"] == "destination_system":
-                type_name = "System"
-
-            waypoint_dict = {
-                "type": type_name,
-                "name": destination["name"],
-                "jumps": len(waypoint_list),
-                "error": waypoint_error,
-                "time": waypoint_time,
-                "path": waypoint_list,
-            }
-
-            total_path.append(waypoint_dict)
-
-            # the next cycle should start where this cycle stopped
-            origin_states = set([waypoint_list[-1]["state_id"]])
-
-    # compute the path from the most recent waypoint to the destination
-    destination_states = get_destination_states(data_dict)
-    waypoint_list, waypoint_time, waypoint_error = compute_waypoint_path(
-        origin_states, destination_states, data_dict
+        stops = [(w["type"], w["id"], w["name"]) for w in waypoints]
+
+    stops.append(
+        (
+            data_dict["destination_type"],
+            get_destination_id(data_dict),
+            data_dict[data_dict["destination_type"]],
+        )
     )
 
-    # determine the name of the waypoint for display purposes
-    if data_dict["destination_type"] == "destination_region":
-        type_name = "Region"
-        destination_name = data_dict["destination_region"]
-    elif data_dict["destination_type"] == "destination_station":
-        type_name = "Station"
-        destination_name = data_dict["destination_station"]
-    elif data_dict["destination_type"] == "destination_system":
-        type_name = "System"
-        destination_name = data_dict["destination_system"]
-
-    waypoint_dict = {
-        "type": type_name,
-        "name": destination_name,
-        "jumps": len(waypoint_list),
-        "error": waypoint_error,
-        "time": waypoint_time,
-        "path": waypoint_list,
-    }
-    total_path.append(waypoint_dict)
+    total_path = []
+    for stop, leg in compute_route_legs(session, origin_states, stops):
+        waypoint_list, waypoint_time, waypoint_error = leg
+
+        waypoint_dict = {
+            "type": stop_type_names[stop[0]],
+            "name": stop[2],
+            "jumps": len(waypoint_list),
+            "error": waypoint_error,
+            "time": waypoint_time,
+            "path": waypoint_list,
+        }
+        total_path.append(waypoint_dict)
 
     # compute stats for the final resulting path
     total_length = sum(p["jumps"] for p in total_path)
@@ -156,78 +221,675 @@ def compute_travel_path(data_dict):
     return total_path, total_length, total_time, total_error
 
 
-def compute_waypoint_path(origin_states, destination_states, data_dict):
+# computes each leg of a route from the origin states through the stops, which are (type, id, name) tuples ending
+# with the destination. returns a list of (stop, (path, time, error)) tuples
+# each leg starts where the previous one finished. if a waypoint can't be reached, the waypoints after it are
+# skipped and the route goes straight on to the destination
+# a leg that starts after a station is independent of the legs before it, since it always starts at that station.
+# if the route worker pool is enabled, each run of legs between stations is computed in a worker process
+def compute_route_legs(session, origin_states, stops):
+    chain_starts = [0]
+    for index in range(1, len(stops)):
+        if stops[index - 1][0] == "destination_station":
+            chain_starts.append(index)
+
+    executor = get_route_executor()
+    chains = None
+
+    if executor is not None and len(chain_starts) > 1:
+
+        # a pool whose worker died while it was idle fails on submit, and one that dies while running the chains
+        # fails on result, so both are handled the same way
+        try:
+            futures = []
+            for start, end in zip(chain_starts, chain_starts[1:] + [len(stops)]):
+                if start == 0:
+                    chain_origin_states = origin_states
+                else:
+                    chain_origin_states = {stops[start - 1][1]}
+
+                futures.append(
+                    executor.submit(
+                        compute_worker_leg_chain,
+                        session.data_dict,
+                        chain_origin_states,
+                        stops[start:end],
+                    )
+                )
+
+            chains = [future.result() for future in futures]
+        except BrokenProcessPool:
+            reset_route_executor(executor)
+
+    # without a pool, or if a worker died, the whole route is computed in this process
+    if chains is None:
+        chain_starts = [0]
+        chains = [compute_leg_chain(session, origin_states, stops)]
+
+    legs = []
+    for start, chain in zip(chain_starts, chains):
+        for index, leg in enumerate(chain, start):
+
+            if len(leg[0]) == 0 and index < len(stops) - 1:
+                if len(legs) > 0:
+                    origin_states = {legs[-1][1][0][-1]["state_id"]}
+
+                destination_states = session.get_destination_states(
+                    stops[-1][0], stops[-1][1]
+                )
+                legs.append(
+                    (
+                        stops[-1],
+                        session.compute_waypoint_path(
+                            origin_states, destination_states
+                        ),
+                    )
+                )
+                return legs
+
+            legs.append((stops[index], leg))
+
+    return legs
+
+
+# computes the legs from the origin states through each of the stops in turn, stopping after the first leg that
+# finds no path. returns a list of (path, time, error) tuples
+def compute_leg_chain(session, origin_states, stops):
+    legs = []
+
+    for stop_type, stop_id, stop_name in stops:
+        destination_states = session.get_destination_states(stop_type, stop_id)
+        leg = session.compute_waypoint_path(origin_states, destination_states)
+        legs.append(leg)
+
+        if len(leg[0]) == 0:
+            break
+
+        # the next leg should start where this one stopped
+        origin_states = {leg[0][-1]["state_id"]}
+
+    return legs
+
+
+# runs compute_leg_chain in a route worker process
+def compute_worker_leg_chain(data_dict, origin_states, stops):
+    return compute_leg_chain(
+        RouteSession(data_dict, keep_trees=True), origin_states, stops
+    )
+
+
+# returns the process pool used to spread independent route searches over several cores, or None if
+# ROUTE_WORKER_PROCESSES is 0. the pool is started the first time it is needed
+# the workers are forked from this process after the route graph has been loaded, so they already hold the
+# snapshot and each task only sends its query and results between processes
+@functools.lru_cache(maxsize=None)
+def get_route_executor():
+    if settings.ROUTE_WORKER_PROCESSES <= 0:
+        return None
+
+    return ProcessPoolExecutor(settings.ROUTE_WORKER_PROCESSES)
+
+
+# drops a pool that has stopped working because one of its worker processes died. a broken pool can't run any
+# more tasks, so the next call to get_route_executor starts a new one
+def reset_route_executor(executor):
+    get_route_executor.cache_clear()
+    executor.shutdown(wait=False)
+
+
+# returns the waypoints reordered to minimize the total cost of the route, which always starts at the origin and
+# finishes at the destination. the cost between every pair of stops is found with one batch of searches: a tree
+# is grown from each stop until it has reached every other stop
+def optimize_waypoint_order(session, origin_states, waypoints, data_dict):
+    points = [origin_states]
+    for waypoint in waypoints:
+        points.append(session.get_destination_states(waypoint["type"], waypoint["id"]))
+    points.append(
+        session.get_destination_states(
+            data_dict["destination_type"], get_destination_id(data_dict)
+        )
+    )
+    points = [session.get_search_states(p) for p in points]
+
+    costs = numpy.full((len(points), len(points)), numpy.inf)
+    numpy.fill_diagonal(costs, 0)
+
+    # nothing is ever travelled to the origin or from the destination, so those searches can be skipped
+    for i in range(len(points) - 1):
+        tree = session.get_tree(points[i])
+
+        for j in range(1, len(points)):
+            if i != j:
+                state = tree.search(points[j])
+
+                if state is not None:
+                    costs[i, j] = tree.costs[state]
+
+    order = tour.optimize_tour(costs.tolist(), 0, len(points) - 1)
+    return [waypoints[i - 1] for i in order]
 
-    avoid_lowsec = data_dict["avoid_lowsec"]
-    maximum_security = data_dict["maximum_security"]
-    avoided_systems = get_avoided_systems(data_dict)
+
+# computes a route for each cleaned path form data dict in the list, ignoring any waypoints. returns a list of
+# (path, time, error) tuples in the same order, in the form returned by compute_waypoint_path
+# queries with the same origin and the same route settings are answered by one session, so they share the search
+# tree grown from their origin and each one only expands it as far as its own destination
+def compute_route_batch(data_dicts):
+    groups = OrderedDict()
+    for index, data_dict in enumerate(data_dicts):
+        groups.setdefault(get_route_group_key(data_dict), []).append(index)
+
+    group_dicts = [[data_dicts[i] for i in indices] for indices in groups.values()]
+
+    # the groups don't share anything, so they can be spread over the route worker pool
+    executor = get_route_executor()
+    group_results = None
+
+    if executor is not None and len(group_dicts) > 1:
+        # send several small groups to a worker at once, while still leaving a few chunks for each worker
+        chunk_size = max(1, len(group_dicts) // (settings.ROUTE_WORKER_PROCESSES * 4))
+
+        try:
+            group_results = list(
+                executor.map(compute_route_group, group_dicts, chunksize=chunk_size)
+            )
+        except BrokenProcessPool:
+            reset_route_executor(executor)
+
+    # without a pool, or if a worker died, the batch is computed in this process
+    if group_results is None:
+        group_results = [compute_route_group(d) for d in group_dicts]
+
+    results = [None] * len(data_dicts)
+    for indices, group_result in zip(groups.values(), group_results):
+        for index, result in zip(indices, group_result):
+            results[index] = result
+
+    return results
+
+
+# computes the routes for a list of queries sharing the same origin and route settings with one session, returning
+# a list of (path, time, error) tuples
+def compute_route_group(data_dicts):
+    session = RouteSession(data_dicts[0], keep_trees=True)
+    origin_states = get_origin_states(data_dicts[0])
+
+    if len(data_dicts) > 1:
+        session.expect_origin(origin_states)
+
+    results = []
+    for data_dict in data_dicts:
+        destination_states = session.get_destination_states(
+            data_dict["destination_type"], get_destination_id(data_dict)
+        )
+        results.append(session.compute_waypoint_path(origin_states, destination_states))
+
+    return results
+
+
+# returns a key that is equal for queries that start from the same place and can share a route session
+def get_route_group_key(data_dict):
+    key = (
+        data_dict["origin_type"],
+        get_origin_id(data_dict),
+        bool(data_dict["avoid_lowsec"]),
+        data_dict["maximum_security"],
+        tuple(sorted(get_avoided_systems(data_dict))),
+        bool(data_dict["autopilot"]),
+        bool(data_dict["compute_travel_time"]),
+    )
 
     if data_dict["compute_travel_time"]:
-        # the provided warp speed is in au/s, we need to convert it to m/s
-        warp_speed = one_au * data_dict["warp_speed"]
-        ship_speed = data_dict["ship_speed"]
-        align_time = data_dict["align_time"]
-    else:
-        warp_speed = one_au * 3
-        ship_speed = 150
-        align_time = 5
+        key += (
+            data_dict["align_time"],
+            data_dict["warp_speed"],
+            data_dict["ship_speed"],
+        )
+
+    return key
+
+
+# computes the number of jumps and the travel time from every source to every target, using the route settings
+# in the cleaned path form data. sources and targets are lists of (location type, id) tuples, where the location
+# type is a form field name such as origin_station or destination_region
+# returns (jumps, times), two tables with a row for each source and a column for each target. a pair that can't be
+# reached holds None in both, and times is None unless compute_travel_time is set. if as_array is set, the tables
+# are 2d numpy arrays holding nan for unreachable pairs
+# one search tree is grown from each source with the same costs as compute_waypoint_path, and it is only
+# expanded until every target has been reached
+def compute_distance_table(data_dict, sources, targets, as_array=False):
+    session = RouteSession(data_dict, keep_trees=True)
 
-    duration_func = get_travel_duration_func(
-        align_time, ship_speed, warp_speed, data_dict["autopilot"]
+    source_states = [get_location_states(t, i) for (t, i) in sources]
+    target_states = [session.get_destination_states(t, i) for (t, i) in targets]
+
+    # the session keeps these trees, so the paths below are read from the grown trees
+    costs = search.cost_table(
+        [session.get_tree(session.get_search_states(s)) for s in source_states],
+        [session.get_search_states(s) for s in target_states],
     )
 
-    # compute the shortest path. do not compute it if the destination systems are a subset of the avoided systems
-    if destination_states < avoided_systems:
-        return []
+    jumps = []
+    times = []
+    for i, origin_states in enumerate(source_states):
+        jump_row = []
+        time_row = []
 
-    def goal_func(state_id):
-        return state_id in destination_states
+        for j, destination_states in enumerate(target_states):
+            if numpy.isinf(costs[i][j]):
+                jump_row.append(None)
+                time_row.append(None)
+            else:
+                path, path_time, path_error = session.compute_waypoint_path(
+                    origin_states, destination_states
+                )
+                jump_row.append(len(path))
+                time_row.append(path_time)
+
+        jumps.append(jump_row)
+        times.append(time_row)
+
+    if not data_dict["compute_travel_time"]:
+        times = None
+
+    if as_array:
+        shape = (len(sources), len(targets))
+        jumps = numpy.array(jumps, dtype=float).reshape(shape)
+
+        if times is not None:
+            times = numpy.array(times, dtype=float).reshape(shape)
+
+    return jumps, times
+
+
+# returns a dict mapping the id of every system within range of the origin to its distance, using the route
+# settings in the cleaned form data. the distance is the number of jumps if max_jumps is given, or the travel time
+# in seconds if max_time is given, and exactly one of them must be given
+# each system is measured along the cheapest route to it under the settings, with the same costs as
+# compute_waypoint_path: avoided systems are never entered, and penalized systems are only crossed if there is no
+# other way. a jump range counts the gate jumps of the route that is found with travel time off. a time range
+# adds up the travel time of each warp, with jumps taking no time, in the same way as compute_waypoint_path
+def compute_reachable_systems(
+    data_dict, origin_type, origin_id, max_jumps=None, max_time=None
+):
+    if (max_jumps is None) == (max_time is None):
+        raise ValueError("Exactly one of max_jumps and max_time is required")
+
+    session = RouteSession(data_dict)
+    origin_states = get_location_states(origin_type, origin_id)
+    origin_systems = frozenset(gate_manager.get_node(s)[0] for s in origin_states)
+
+    # only the number of jumps matters, so the search runs over the condensed system graph
+    if max_jumps is not None:
+
+        def system_neighbor_func(system_id):
+            return [
+                (neighbor_id, cost, 1)
+                for (neighbor_id, cost) in session.system_neighbor_func(
+                    system_id, origin_systems
+                )
+            ]
+
+        return {
+            system_id: jumps
+            for (system_id, jumps) in search.measured_search(
+                origin_systems, system_neighbor_func, max_jumps
+            ).items()
+            if jumps <= max_jumps
+        }
 
-    # create a function to return the valid neighbors of a given state
     def neighbor_func(state_id):
-        new_states = gate_manager.get_neighbors(state_id)
+        system_id = gate_manager.get_node(state_id)[0]
 
         result = list()
-        for state_id, distance in new_states:
-            system_id, system_security = gate_manager.get_node(state_id)
+        for neighbor_id, cost in gate_manager.get_neighbors(
+            state_id, session.edge_costs
+        ):
+            # a jump is the only way to reach another system
+            if gate_manager.get_node(neighbor_id)[0] == system_id:
+                warp_time = cost
+            else:
+                warp_time = 0
 
-            if system_id not in avoided_systems:
-                system_security = round(system_security, 1) - 0.01
+            cost = session.entry_cost(neighbor_id, cost, origin_systems)
+            if cost is not None:
+                result.append((neighbor_id, cost, warp_time))
 
-                if distance is None:
-                    cost = 10  # 10 seconds to jump from one system to another
+        return result
 
-                else:
-                    cost = duration_func(distance)
+    # a route to a system finishes at the first of its states to be reached, which is the first one settled
+    system_times = dict()
+    for state_id, state_time in search.measured_search(
+        origin_states, neighbor_func, max_time
+    ).items():
+        system_id = gate_manager.get_node(state_id)[0]
+
+        if system_id not in system_times:
+            system_times[system_id] = state_time
+
+    return {
+        system_id: state_time
+        for (system_id, state_time) in system_times.items()
+        if state_time <= max_time
+    }
+
+
+# if stats is a dict, the number of states expanded by the search is stored in stats["expanded"]
+def compute_waypoint_path(origin_states, destination_states, data_dict, stats=None):
+    return RouteSession(data_dict).compute_waypoint_path(
+        origin_states, destination_states, stats
+    )
+
+
+# holds everything that is shared by the searches made for a single route request: the avoided systems, the ship's
+# edge costs and, if keep_trees is set, the search trees grown from origins that are searched more than once. a
+# later search from such an origin is answered from the settled part of its tree, and only expands it further if
+# the new destination hasn't been reached yet. an origin that is only searched once uses the faster heuristic or
+# bidirectional searches instead, since a plain tree explores everything closer than the destination
+# when travel time isn't computed, only the number of jumps matters, so the searches run over the condensed system
+# graph instead of the full graph of gates and stations, and the chosen systems are expanded back into states. if
+# nothing is avoided or penalized, they are answered by the contraction hierarchy over the system graph
+# both kinds of search let a route move around and leave the systems it starts in, even if they are avoided, so a
+# query finds a route with travel time on exactly when it finds one with travel time off
+class RouteSession:
+    def __init__(self, data_dict, keep_trees=False):
+        self.data_dict = data_dict
+        self.keep_trees = keep_trees
+
+        self.avoid_lowsec = data_dict["avoid_lowsec"]
+        self.maximum_security = data_dict["maximum_security"]
+        self.avoided_systems = get_avoided_systems(data_dict)
+        self.is_autopilot = bool(data_dict["autopilot"])
+        self.use_system_graph = not data_dict["compute_travel_time"]
+
+        if data_dict["compute_travel_time"]:
+            # the provided warp speed is in au/s, we need to convert it to m/s
+            self.warp_speed = one_au * data_dict["warp_speed"]
+            self.ship_speed = data_dict["ship_speed"]
+            self.align_time = data_dict["align_time"]
+        else:
+            self.warp_speed = default_warp_speed
+            self.ship_speed = default_ship_speed
+            self.align_time = default_align_time
+
+        self.duration_func = get_travel_duration_func(
+            self.align_time, self.ship_speed, self.warp_speed, self.is_autopilot
+        )
+        self.edge_costs = get_edge_costs(
+            self.align_time, self.ship_speed, self.warp_speed, self.is_autopilot
+        )
+
+        # security levels never round above 0.99, so a maximum security of 1.0 doesn't penalize anything
+        self.is_unconstrained = (
+            len(self.avoided_systems) == 0
+            and not self.avoid_lowsec
+            and (self.maximum_security is None or self.maximum_security >= 1.0)
+        )
+
+        # map from a frozenset of origin search states to the search tree grown from them
+        self.trees = dict()
+
+        # the frozensets of origin search states that have been searched from, or are expected to be
+        self.searched_origins = set()
+
+        # map from (destination type, id) to the set of destination states
+        self.destinations = dict()
+
+    # returns the set of states for a destination, finding each destination's states only once per session
+    def get_destination_states(self, destination_type, destination_id):
+        key = (destination_type, destination_id)
+
+        if key not in self.destinations:
+            self.destinations[key] = get_location_states(
+                destination_type, destination_id
+            )
+
+        return self.destinations[key]
+
+    # returns the states searched for the given set of states: the states themselves, or their systems if the
+    # condensed system graph is used
+    def get_search_states(self, states):
+        if self.use_system_graph:
+            return {gate_manager.get_node(s)[0] for s in states}
+
+        return states
+
+    # returns the systems containing the given origin search states. a route can always move around and leave the
+    # systems it starts in, even if the settings avoid or penalize them, in the same way as a range query
+    def get_origin_systems(self, origin_states):
+        if self.use_system_graph:
+            return frozenset(origin_states)
+
+        return frozenset(gate_manager.get_node(s)[0] for s in origin_states)
+
+    # returns the cost of moving into a state along an edge with the given base cost, or None if the state
+    # can't be entered. origin_systems are the systems of the search's origin, which are never avoided
+    def entry_cost(self, state_id, cost, origin_systems=frozenset()):
+        system_id, system_security = gate_manager.get_node(state_id)
+        return self.system_entry_cost(system_id, system_security, cost, origin_systems)
+
+    # returns the cost of moving into a system along an edge with the given base cost, or None if the system
+    # can't be entered
+    def system_entry_cost(
+        self, system_id, system_security, cost, origin_systems=frozenset()
+    ):
+        if system_id in origin_systems:
+            return cost
+
+        if system_id in self.avoided_systems:
+            return None
+
+        if self.is_penalized(system_security):
+            cost *= 1000
+
+        return cost
 
-                if maximum_security is not None and system_security > maximum_security:
-                    cost *= 1000
-                elif system_security < 0.45 and avoid_lowsec:
-                    cost *= 1000
+    # returns True if the route settings discourage entering a system with the given security level
+    def is_penalized(self, system_security):
+        system_security = round(system_security, 1) - 0.01
 
+        if (
+            self.maximum_security is not None
+            and system_security > self.maximum_security
+        ):
+            return True
+
+        return system_security < 0.45 and self.avoid_lowsec
+
+    # returns the valid neighbors of a given state
+    def neighbor_func(self, state_id, origin_systems=frozenset()):
+        new_states = gate_manager.get_neighbors(state_id, self.edge_costs)
+
+        result = list()
+        for state_id, cost in new_states:
+            cost = self.entry_cost(state_id, cost, origin_systems)
+
+            if cost is not None:
                 result.append((state_id, cost))
 
         return result
 
-    path = search.uniform_cost_search(origin_states, goal_func, neighbor_func)
-    path = gate_manager.trace_path(path)
+    # returns the valid neighbors of a system in the condensed system graph, where every edge is a single jump
+    def system_neighbor_func(self, system_id, origin_systems=frozenset()):
+        result = list()
+        for neighbor_id in gate_manager.get_system_neighbors(system_id):
+            cost = self.system_entry_cost(
+                neighbor_id,
+                gate_manager.get_system_security(neighbor_id),
+                jump_time,
+                origin_systems,
+            )
 
-    if data_dict["compute_travel_time"]:
-        error = compute_travel_error(data_dict, path)
+            if cost is not None:
+                result.append((neighbor_id, cost))
 
-        for p in path:
-            if p["distance"]:
-                p["travel_time"] = duration_func(p["distance"])
-            else:
-                p["travel_time"] = 0
+        return result
 
-        path_time = sum(p["travel_time"] for p in path)
+    # every edge has a matching edge in the opposite direction, and the cost of an edge only depends on its
+    # distance and the state it enters. so the states leading into a state are its neighbors, and moving from
+    # them costs the same as entering the given state from them
+    def reverse_neighbor_func(self, state_id, origin_systems=frozenset()):
+        new_states = gate_manager.get_neighbors(state_id, self.edge_costs)
 
-    else:
-        error = None
-        path_time = None
+        result = list()
+        for prev_state_id, cost in new_states:
+            cost = self.entry_cost(state_id, cost, origin_systems)
+
+            if cost is not None:
+                result.append((prev_state_id, cost))
+
+        return result
+
+    # returns the neighbor function for searches from the given origin search states: over systems in the
+    # condensed graph, or over states otherwise
+    def get_neighbor_func(self, origin_states):
+        if self.use_system_graph:
+            neighbor_func = self.system_neighbor_func
+        else:
+            neighbor_func = self.neighbor_func
+
+        return functools.partial(
+            neighbor_func, origin_systems=self.get_origin_systems(origin_states)
+        )
+
+    # records that several searches will start from the given origin states, so that the first of them already
+    # grows a tree that the others can reuse
+    def expect_origin(self, origin_states):
+        self.searched_origins.add(frozenset(self.get_search_states(origin_states)))
+
+    # returns True if a tree should be grown for the given origin search states, which is the case once they are
+    # searched from a second time. the origin is recorded as searched
+    def should_keep_tree(self, origin_states):
+        key = frozenset(origin_states)
+        is_repeated = key in self.searched_origins
+        self.searched_origins.add(key)
+
+        return self.keep_trees and is_repeated
+
+    # returns the search tree grown from the given origin search states, creating it if needed
+    def get_tree(self, origin_states):
+        key = frozenset(origin_states)
+
+        if key not in self.trees:
+            self.trees[key] = search.SearchTree(
+                origin_states, self.get_neighbor_func(origin_states)
+            )
+
+        return self.trees[key]
+
+    # returns the list of states on the cheapest path from any of the origin states to any of the destination states
+    def find_path(self, origin_states, destination_states, stats=None):
+        if self.use_system_graph:
+            return self.find_system_path(origin_states, destination_states, stats)
+
+        # answer from an existing tree first, since its settled states cost nothing to reuse
+        tree = self.trees.get(frozenset(origin_states))
+
+        if tree is None and self.should_keep_tree(origin_states):
+            tree = self.get_tree(origin_states)
+
+        if tree is not None:
+            path = tree.find_path(destination_states)
+
+            if stats is not None:
+                stats["expanded"] = len(tree.costs)
 
-    return path, path_time, error
+            return path
+
+        origin_systems = self.get_origin_systems(origin_states)
+
+        # avoidance settings make the lower bounds loose, so meet in the middle to keep the explored radius small
+        if not self.is_unconstrained:
+            return search.bidirectional_search(
+                origin_states,
+                destination_states,
+                functools.partial(self.neighbor_func, origin_systems=origin_systems),
+                functools.partial(
+                    self.reverse_neighbor_func, origin_systems=origin_systems
+                ),
+                stats,
+            )
+
+        # the landmark table was built from a lower bound on every ship's edge costs, so its bounds are valid
+        # for any ship, flown manually or with autopilot
+        heuristic_func = get_landmark_heuristic(destination_states)
+
+        if heuristic_func is None:
+            heuristic_func = get_jump_heuristic(destination_states)
+
+        def goal_func(state_id):
+            return state_id in destination_states
+
+        return search.astar_search(
+            origin_states,
+            goal_func,
+            self.get_neighbor_func(origin_states),
+            heuristic_func,
+            stats,
+        )
+
+    # finds the path with the fewest jumps through the condensed system graph, then expands it back into states
+    def find_system_path(self, origin_states, destination_states, stats=None):
+        origin_systems = self.get_search_states(origin_states)
+        destination_systems = self.get_search_states(destination_states)
+
+        tree = self.trees.get(frozenset(origin_systems))
+        if tree is None and self.should_keep_tree(origin_systems):
+            tree = self.get_tree(origin_systems)
+
+        if tree is not None:
+            system_path = tree.find_path(destination_systems)
+
+            if stats is not None:
+                stats["expanded"] = len(tree.costs)
+
+        else:
+            system_path = None
+
+            # every jump costs the same when nothing is avoided or penalized, which is what the system hierarchy
+            # was built with
+            if self.is_unconstrained:
+                system_path = gate_manager.find_system_hierarchy_path(
+                    origin_systems, destination_systems, stats
+                )
+
+            if system_path is None:
+
+                def goal_func(system_id):
+                    return system_id in destination_systems
+
+                system_path = search.astar_search(
+                    origin_systems,
+                    goal_func,
+                    self.get_neighbor_func(origin_systems),
+                    get_system_jump_heuristic(destination_systems),
+                    stats,
+                )
+
+        return gate_manager.expand_system_path(
+            system_path, origin_states, destination_states
+        )
+
+    # returns the path between the state sets in display form, along with its travel time and error
+    def compute_waypoint_path(self, origin_states, destination_states, stats=None):
+        path = self.find_path(origin_states, destination_states, stats)
+        path = gate_manager.trace_path(path)
+
+        if self.data_dict["compute_travel_time"]:
+            error = compute_travel_error(self.data_dict, path)
+
+            for p in path:
+                if p["distance"]:
+                    p["travel_time"] = self.duration_func(p["distance"])
+                else:
+                    p["travel_time"] = 0
+
+            path_time = sum(p["travel_time"] for p in path)
+
+        else:
+            error = None
+            path_time = None
+
+        return path, path_time, error
 
 
 # given a list of adjancent systems representing a path, returns a list containing the travel time for each system
@@ -259,9 +921,153 @@ Utility functions to be used inside of dijkstra's search
 """
 
 
+# this function returns an a* heuristic that estimates the cost of reaching the destination states
+# every gate jump costs at least jump_time, so the minimum number of jumps from a system to the nearest
+# destination system times jump_time never overestimates, no matter which avoidance settings are used
+def get_jump_heuristic(destination_states):
+    destination_systems = {gate_manager.get_node(s)[0] for s in destination_states}
+    system_heuristic = get_system_jump_heuristic(destination_systems)
+
+    def estimate_cost(state_id):
+        system_id, system_security = gate_manager.get_node(state_id)
+        return system_heuristic(system_id)
+
+    return estimate_cost
+
+
+# the same heuristic for searches over the condensed system graph, where the states are system ids
+def get_system_jump_heuristic(destination_systems):
+    system_jumps = get_system_jumps(destination_systems)
+
+    def estimate_cost(system_id):
+        return jump_time * system_jumps.get(system_id, 0)
+
+    return estimate_cost
+
+
+# returns a dict mapping each system id to the minimum number of jumps to the nearest of the given systems
+# the precomputed jump matrix is used if it is available, otherwise the gate network is searched
+def get_system_jumps(destination_systems):
+    jump_matrix = gate_manager.get_jump_matrix()
+
+    if jump_matrix is None:
+        return search.breadth_first_depths(
+            destination_systems, gate_manager.get_system_neighbors
+        )
+
+    # gates work in both directions, so jumps to a system are the same as jumps from it
+    nearest = numpy.minimum.reduce(
+        [jump_matrix.jumps_from(system_id) for system_id in destination_systems]
+    )
+
+    return dict(zip(jump_matrix.system_ids.tolist(), nearest.tolist()))
+
+
+# this function returns an a* heuristic using the landmark table, or None if it hasn't been built
+def get_landmark_heuristic(destination_states):
+    bounds = gate_manager.get_landmark_bounds(destination_states)
+
+    if bounds is None:
+        return None
+
+    def estimate_cost(state_id):
+        return bounds[gate_manager.get_index(state_id)]
+
+    return estimate_cost
+
+
+# a least recently used cache of edge cost arrays, keyed by ship profile
+# arrays are evicted once their combined size is over max_bytes, so the memory used by each worker stays bounded
+class EdgeCostCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.entries = OrderedDict()
+
+    def get(self, align_time, ship_speed, warp_speed, is_autopilot):
+        key = (align_time, ship_speed, warp_speed, bool(is_autopilot))
+
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        edge_costs = compute_edge_costs(gate_manager.get_graph(), *key)
+
+        # the cached array is shared between requests, so make sure nothing modifies it
+        edge_costs.flags.writeable = False
+
+        self.entries[key] = edge_costs
+        self.total_bytes += edge_costs.nbytes
+
+        # always keep the newest entry, even if it is larger than the limit on its own
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            key, evicted = self.entries.popitem(last=False)
+            self.total_bytes -= evicted.nbytes
+
+        return edge_costs
+
+
+edge_cost_cache = EdgeCostCache(settings.EDGE_COST_CACHE_BYTES)
+
+
+# returns a read only array with the cost of every edge in the graph, parallel to the graph's edge arrays, for
+# the given ship. the arrays for recently used ships are cached
+def get_edge_costs(align_time, ship_speed, warp_speed, is_autopilot):
+    return edge_cost_cache.get(align_time, ship_speed, warp_speed, is_autopilot)
+
+
+# computes the cost of every edge in the given graph for the given ship. every warp edge is costed in a single
+# vectorized pass
+def compute_edge_costs(graph, align_time, ship_speed, warp_speed, is_autopilot):
+    distances = graph.weights
+    is_jump = numpy.isnan(distances)
+
+    warp_times = travel_time.compute_warp_times(
+        numpy.where(is_jump, 1.0, distances), ship_speed, warp_speed
+    )
+
+    return numpy.where(
+        is_jump,
+        jump_time,
+        get_non_warp_time(align_time, ship_speed, is_autopilot) + warp_times,
+    )
+
+
+# precompute the landmark table used by get_landmark_heuristic from the graph loaded by the given manager
+# the import command passes a manager loaded after the import, rather than the one this module loaded at startup
+def build_landmark_index(manager, landmark_count):
+    manager.build_landmarks(
+        compute_edge_cost_bounds(manager.get_graph()), landmark_count
+    )
+
+
+# returns a lower bound on the cost of every edge in the graph, for any ship. a jump always takes jump_time, and
+# a warp always takes at least the time a ship flown manually spends outside of warp with no align time. the
+# landmark costs computed from these never overestimate the cost of a route, whatever ship is flown
+def compute_edge_cost_bounds(graph):
+    return numpy.where(
+        numpy.isnan(graph.weights),
+        jump_time,
+        get_non_warp_time(0, default_ship_speed, False),
+    )
+
+
 # this function returns a function that takes a distance and returns the time taken to travel that distance, given the parameters supplied here
 def get_travel_duration_func(align_time, ship_speed, warp_speed, is_autopilot):
 
+    non_warp_time = get_non_warp_time(align_time, ship_speed, is_autopilot)
+
+    def compute_travel_duration(distance):
+        return non_warp_time + travel_time.compute_warp_time(
+            distance, ship_speed, warp_speed
+        )
+
+    return compute_travel_duration
+
+
+# returns the time spent on each warp outside of warp itself: waiting, aligning and approaching the gate
+def get_non_warp_time(align_time, ship_speed, is_autopilot):
+
     if is_autopilot:
         times = {
             "wait_begin": 9,
@@ -281,11 +1087,4 @@ def get_travel_duration_func(align_time, ship_speed, warp_speed, is_autopilot):
             "approach": 1,
         }
 
-    non_warp_time = sum(times.values())
-
-    def compute_travel_duration(distance):
-        return non_warp_time + travel_time.compute_warp_time(
-            distance, ship_speed, warp_speed
-        )
-
-    return compute_travel_duration
+    return sum(times.values())
@@ -0,0 +1,278 @@
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from unittest import mock
+
+import numpy
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.test import TestCase, override_settings
+
+from math_utils import landmarks
+from static_dump import dump_manager
+
+# three systems in one region, each with two stargates
+test_systems = [
+    (30000001, "Alpha", 1.0),
+    (30000002, "Bravo", 0.9),
+    (30000003, "Charlie", 0.5),
+]
+
+# map from stargate id to its system and position
+test_gates = {
+    50000001: (30000001, (0.0, 0.0, 0.0)),
+    50000002: (30000001, (2e12, 0.0, 0.0)),
+    50000003: (30000002, (0.0, 0.0, 0.0)),
+    50000004: (30000002, (3e12, 0.0, 0.0)),
+    50000005: (30000003, (0.0, 0.0, 0.0)),
+    50000006: (30000003, (5e12, 0.0, 0.0)),
+}
+
+
+# writes a static dump in the sqlite format read by the import command. connections is a list of pairs of
+# stargate ids that lead to each other
+def write_test_dump(filename, connections):
+    con = sqlite3.connect(filename)
+    con.executescript(
+        """
+        CREATE TABLE mapregions (regionID INTEGER, regionName TEXT);
+        CREATE TABLE mapconstellations (constellationID INTEGER, constellationName TEXT, regionID INTEGER);
+        CREATE TABLE mapsolarsystems (
+            solarSystemID INTEGER, solarSystemName TEXT, security REAL, constellationID INTEGER, regionID INTEGER
+        );
+        CREATE TABLE mapdenormalize (itemID INTEGER, solarSystemID INTEGER, x REAL, y REAL, z REAL);
+        CREATE TABLE mapjumps (stargateID INTEGER, destinationID INTEGER);
+        CREATE TABLE stastations (
+            stationID INTEGER, stationName TEXT, solarSystemID INTEGER, x REAL, y REAL, z REAL
+        );
+        INSERT INTO mapregions VALUES (10000001, 'Test Region');
+        INSERT INTO mapconstellations VALUES (20000001, 'Test Constellation', 10000001);
+        """
+    )
+
+    for (system_id, name, security) in test_systems:
+        con.execute(
+            "INSERT INTO mapsolarsystems VALUES (?, ?, ?, 20000001, 10000001)",
+            (system_id, name, security),
+        )
+
+    for gate_id, (system_id, position) in test_gates.items():
+        con.execute(
+            "INSERT INTO mapdenormalize VALUES (?, ?, ?, ?, ?)",
+            (gate_id, system_id) + position,
+        )
+
+    for (a, b) in connections:
+        con.execute("INSERT INTO mapjumps VALUES (?, ?)", (a, b))
+        con.execute("INSERT INTO mapjumps VALUES (?, ?)", (b, a))
+
+    con.commit()
+    con.close()
+
+
+# stands in for the searches of a chain of route legs, so that the route worker pool can be tested without a map.
+# it takes the arguments of compute_leg_chain or compute_worker_leg_chain, and each leg finishes at its stop
+def fake_leg_chain(*args):
+    stops = args[-1]
+    return [([{"state_id": stop_id}], 0, 0) for (stop_type, stop_id, name) in stops]
+
+
+class IncrementalImportTest(TestCase):
+    def setUp(self):
+        self.index_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.index_directory)
+
+        # keep the route indexes written by the import out of the project directory
+        patcher = mock.patch.object(
+            dump_manager,
+            "get_index_path",
+            lambda filename: os.path.join(self.index_directory, filename),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def import_dump(self, connections, incremental=False):
+        filename = os.path.join(self.index_directory, "dump.sqlite")
+        if os.path.exists(filename):
+            os.remove(filename)
+
+        write_test_dump(filename, connections)
+        call_command(
+            "import_eve_dump",
+            filename,
+            landmarks=2,
+            processes=1,
+            incremental=incremental,
+        )
+
+    def test_changed_gate_rebuilds_indexes(self):
+        # the route services load the map when they are imported, so they are only imported once the test
+        # database is in place
+        from maps import services
+
+        self.import_dump(
+            [(50000001, 50000003), (50000004, 50000005), (50000002, 50000006)]
+        )
+        old_version = dump_manager.read_dump_version()
+        old_distances = dump_manager.load_index(dump_manager.landmark_filename)[
+            "distances"
+        ]
+
+        # the gates stay the same, but they are connected the other way around the triangle of systems. the set of
+        # nodes doesn't change, which is the case where stale indexes would still be loaded
+        self.import_dump(
+            [(50000001, 50000006), (50000004, 50000005), (50000002, 50000003)],
+            incremental=True,
+        )
+
+        version = dump_manager.read_dump_version()
+        self.assertNotEqual(version, old_version)
+        self.assertTrue(
+            os.path.isdir(
+                dump_manager.get_index_path(dump_manager.snapshot_prefix + version)
+            )
+        )
+
+        gate_manager = dump_manager.GateWarpManager()
+        neighbor_ids = [
+            node_id for (node_id, distance) in gate_manager.get_neighbors(50000001)
+        ]
+        self.assertIn(50000006, neighbor_ids)
+        self.assertNotIn(50000003, neighbor_ids)
+
+        # the landmark table and the jump matrix were built from the changed graph
+        landmark_indices, expected_distances = landmarks.select_landmarks(
+            gate_manager.get_graph().to_matrix(
+                services.compute_edge_cost_bounds(gate_manager.get_graph())
+            ),
+            2,
+        )
+        distances = dump_manager.load_index(dump_manager.landmark_filename)[
+            "distances"
+        ]
+        numpy.testing.assert_allclose(distances, expected_distances)
+        self.assertFalse(numpy.array_equal(distances, old_distances))
+
+        jump_matrix = gate_manager.get_jump_matrix()
+        self.assertEqual(jump_matrix.jumps_from(30000001).tolist(), [0, 1, 1])
+
+
+class RouteBatchTest(TestCase):
+    def post_queries(self, queries):
+        return self.client.post(
+            reverse("maps.route_batch"),
+            json.dumps({"queries": queries}),
+            content_type="application/json",
+        )
+
+    def test_invalid_query(self):
+        response = self.post_queries(
+            [{"origin_system": "Nowhere", "destination_system": "Nowhere"}]
+        )
+
+        self.assertEqual(response.status_code, 400)
+
+        errors = json.loads(response.content.decode("utf-8"))["errors"]
+        self.assertEqual(len(errors), 1)
+        self.assertIn("origin_system", errors[0])
+        self.assertIn("destination_system", errors[0])
+
+    def test_empty_location(self):
+        # the destination type defaults to a system, so the empty station name leaves the destination missing
+        response = self.post_queries([{"origin_system": "", "destination_station": ""}])
+
+        self.assertEqual(response.status_code, 400)
+
+        errors = json.loads(response.content.decode("utf-8"))["errors"]
+        self.assertEqual(len(errors), 1)
+        self.assertIn("origin_system", errors[0])
+        self.assertIn("destination_system", errors[0])
+
+    def test_malformed_body(self):
+        response = self.client.post(
+            reverse("maps.route_batch"), "[]", content_type="application/json"
+        )
+
+        self.assertEqual(response.status_code, 400)
+
+
+class DistanceTableTest(TestCase):
+    def post_query(self, query):
+        return self.client.post(
+            reverse("maps.distance_table"),
+            json.dumps(query),
+            content_type="application/json",
+        )
+
+    def test_empty_location(self):
+        response = self.post_query(
+            {
+                "sources": [{"type": "system", "name": ""}],
+                "targets": [{"type": "station", "name": " "}],
+            }
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("error", json.loads(response.content.decode("utf-8")))
+
+    def test_malformed_body(self):
+        response = self.post_query({"sources": []})
+
+        self.assertEqual(response.status_code, 400)
+
+
+class ReachableSystemsTest(TestCase):
+    def test_empty_origin(self):
+        response = self.client.get(
+            reverse("maps.reachable_systems"), {"origin_system": "", "max_jumps": "3"}
+        )
+
+        self.assertEqual(response.status_code, 400)
+
+        errors = json.loads(response.content.decode("utf-8"))["errors"]
+        self.assertIn("origin_system", errors)
+
+
+@override_settings(ROUTE_WORKER_PROCESSES=1)
+class RouteWorkerPoolTest(TestCase):
+    def test_dead_worker(self):
+        from maps import services
+
+        services.get_route_executor.cache_clear()
+        self.addCleanup(services.get_route_executor.cache_clear)
+
+        # start the worker, then kill it while it is idle and wait for the pool to notice
+        executor = services.get_route_executor()
+        executor.submit(int).result()
+        for process in list(executor._processes.values()):
+            process.terminate()
+            process.join()
+
+        deadline = time.time() + 10
+        while not executor._broken and time.time() < deadline:
+            time.sleep(0.01)
+
+        # the station splits the route into two chains of legs, which are run in the pool
+        stops = [
+            ("destination_station", 60000001, "Station"),
+            ("destination_system", 30000002, "Bravo"),
+        ]
+        expected = [(stop, ([{"state_id": stop[1]}], 0, 0)) for stop in stops]
+
+        with mock.patch.object(
+            services, "compute_leg_chain", fake_leg_chain
+        ), mock.patch.object(services, "compute_worker_leg_chain", fake_leg_chain):
+
+            # the first route finds the pool broken and is computed in this process, and the second one is
+            # computed by a new pool
+            for i in range(2):
+                session = mock.Mock(data_dict={})
+                self.assertEqual(
+                    services.compute_route_legs(session, {30000001}, stops), expected
+                )
+
+        self.assertIsNot(services.get_route_executor(), executor)
+        services.get_route_executor().shutdown()
@@ -11,3 +11,9 @@ urlpatterns += [
     url("^waypoints/add/$", views.add_waypoint, name="maps.add_waypoint"),
     url("^waypoints/save/$", views.save_waypoints, name="maps.save_waypoints"),
 ]
+
+urlpatterns += [
+    url("^api/routes/$", views.route_batch, name="maps.route_batch"),
+    url("^api/distances/$", views.distance_table, name="maps.distance_table"),
+    url("^api/range/$", views.reachable_systems, name="maps.reachable_systems"),
+]
@@ -1,14 +1,22 @@
 import json
 
+from django.conf import settings
 from django.core.urlresolvers import reverse
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render_to_response
 from django.template import RequestContext
 from django.template.loader import render_to_string
 from django.views.decorators.csrf import csrf_exempt, ensure_csrf_cookie
+from django.views.decorators.http import require_POST
 
-from maps.forms import PathForm, WaypointForm
-from maps.services import compute_travel_path
+from maps.forms import PathForm, RangeForm, RouteSettingsForm, WaypointForm
+from maps.services import (
+    compute_travel_path,
+    compute_route_batch,
+    compute_distance_table,
+    compute_reachable_systems,
+    gate_manager,
+)
 
 from static_dump.models import MapRegion, MapSolarSystem, Station
 
@@ -17,6 +25,17 @@ class WaypointValidationException(Exception):
     pass
 
 
+# values used for the path form fields that a route api query leaves out
+route_query_defaults = {
+    "origin_type": "origin_system",
+    "destination_type": "destination_system",
+    "maximum_security": "1.0",
+}
+
+# the kinds of location that can be used as the sources and targets of a distance table
+table_location_kinds = ("system", "station", "region")
+
+
 def shortest_path(request):
     path = None
     path_time = None
@@ -114,37 +133,23 @@ def add_waypoint(request):
     waypoint_form = WaypointForm(request.GET)
     if waypoint_form.is_valid():
 
-        response_data = {}
-        response_data["type"] = waypoint_form.cleaned_data["destination_type"]
-
-        if response_data["type"] == "destination_system":
-
-            system = MapSolarSystem.objects.values("id", "name", "security_level").get(
-                name=waypoint_form.cleaned_data["destination_system"]
-            )
-
-            response_data["id"] = system["id"]
-            response_data["name"] = system["name"]
-            response_data["security"] = system["security_level"]
-
-        elif response_data["type"] == "destination_station":
+        destination_type = waypoint_form.cleaned_data["destination_type"]
+        destination_id = waypoint_form.cleaned_data["destination_id"]
 
-            station = Station.objects.values(
-                "id", "name", "solar_system__security_level"
-            ).get(name=waypoint_form.cleaned_data["destination_station"])
-
-            response_data["id"] = station["id"]
-            response_data["name"] = station["name"]
-            response_data["security"] = station["solar_system__security_level"]
+        response_data = {}
+        response_data["type"] = destination_type
+        response_data["id"] = destination_id
+        response_data["name"] = waypoint_form.cleaned_data[destination_type]
 
-        elif response_data["type"] == "destination_region":
+        # the form resolved the name to an id, so the rest comes from the loaded map instead of the database
+        if destination_type == "destination_system":
+            response_data["security"] = gate_manager.get_system_security(destination_id)
 
-            region = MapRegion.objects.values("id", "name").get(
-                name=waypoint_form.cleaned_data["destination_region"]
-            )
+        elif destination_type == "destination_station":
+            system_id, security = gate_manager.get_node(destination_id)
+            response_data["security"] = security
 
-            response_data["id"] = region["id"]
-            response_data["name"] = region["name"]
+        elif destination_type == "destination_region":
             response_data["security"] = None
 
         # render the waypoint entry template
@@ -263,3 +268,204 @@ def save_waypoints(request):
             return HttpResponse(json.dumps({"success": False, "response": ""}))
     else:
         raise Http404()
+
+
+# returns the errors of an invalid form as a dict mapping each field name to a list of {"message", "code"} objects
+def get_form_errors(form):
+    return json.loads(form.errors.as_json())
+
+
+# a stateless json api that computes many routes in one request. the body is a json object with a "queries" list,
+# where each query is an object holding the same fields as the path form, such as
+# {"origin_system": "Jita", "destination_system": "Amarr", "avoid_lowsec": true}
+# the response has a "results" list in the same order. each result holds the number of jumps, the travel time
+# and error (null unless compute_travel_time is set) and the list of locations on the path
+# if any query isn't valid, nothing is computed and the response is a 400 with an "errors" list in the same order,
+# holding the form errors of each invalid query and null for the valid ones
+@csrf_exempt
+@require_POST
+def route_batch(request):
+
+    try:
+        queries = json.loads(request.body.decode("utf-8"))["queries"]
+        if not isinstance(queries, list) or not all(
+            isinstance(query, dict) for query in queries
+        ):
+            raise ValueError()
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse(
+            {"error": "Expected a json object with a list of queries"}, status=400
+        )
+
+    if len(queries) > settings.ROUTE_BATCH_MAX_QUERIES:
+        return JsonResponse(
+            {
+                "error": "At most %d queries are allowed"
+                % settings.ROUTE_BATCH_MAX_QUERIES
+            },
+            status=400,
+        )
+
+    query_data = []
+    query_errors = []
+
+    for query in queries:
+        data = dict(route_query_defaults)
+        data.update(query)
+
+        path_form = PathForm(data)
+        if path_form.is_valid():
+            query_data.append(path_form.cleaned_data)
+            query_errors.append(None)
+        else:
+            query_errors.append(get_form_errors(path_form))
+
+    if any(errors is not None for errors in query_errors):
+        return JsonResponse({"errors": query_errors}, status=400)
+
+    results = []
+    for (path, path_time, path_error) in compute_route_batch(query_data):
+        results.append(
+            {
+                "jumps": len(path),
+                "time": path_time,
+                "error": path_error,
+                "path": [p["location"] for p in path],
+            }
+        )
+
+    return JsonResponse({"results": results})
+
+
+# a stateless json api that computes the jumps and travel time from every source to every target. the body is a
+# json object with "sources" and "targets" lists of locations, such as {"type": "station", "name": "Jita IV -
+# Moon 4 - Caldari Navy Assembly Plant"}, where the type is "system", "station" or "region". the other fields
+# are route settings, the same as for the path form, such as "avoid_lowsec" or "compute_travel_time"
+# the response holds the "jumps" and "time" tables with a row for each source and a column for each target. a
+# pair that can't be reached holds null, and "time" is null unless compute_travel_time is set
+# each cell describes the route the path form would find between the pair. the time in seconds adds up the time of
+# every warp on it, including aligning and waiting, while gate jumps take no time. the range api uses the same time
+@csrf_exempt
+@require_POST
+def distance_table(request):
+
+    try:
+        query = json.loads(request.body.decode("utf-8"))
+        locations = {"sources": query.pop("sources"), "targets": query.pop("targets")}
+
+        for location_list in locations.values():
+            if not isinstance(location_list, list) or not all(
+                isinstance(location, dict)
+                and location.get("type") in table_location_kinds
+                and isinstance(location.get("name"), str)
+                and location["name"].strip()
+                for location in location_list
+            ):
+                raise ValueError()
+
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return JsonResponse(
+            {
+                "error": "Expected a json object with lists of sources and targets, "
+                "each with a type and a name"
+            },
+            status=400,
+        )
+
+    # every cell of the table costs about as much as one query of the batch route api
+    if (
+        len(locations["sources"]) * len(locations["targets"])
+        > settings.ROUTE_BATCH_MAX_QUERIES
+    ):
+        return JsonResponse(
+            {
+                "error": "At most %d source and target pairs are allowed"
+                % settings.ROUTE_BATCH_MAX_QUERIES
+            },
+            status=400,
+        )
+
+    data = dict(route_query_defaults)
+    data.update(query)
+
+    settings_form = RouteSettingsForm(data)
+    if not settings_form.is_valid():
+        return JsonResponse({"errors": get_form_errors(settings_form)}, status=400)
+
+    # resolve the locations to ids, keeping the names as they are written in the static dump for the response
+    resolver = gate_manager.get_name_resolver()
+    resolved = {"sources": [], "targets": []}
+    names = {"sources": [], "targets": []}
+    not_found = []
+
+    for key, prefix in (("sources", "origin_"), ("targets", "destination_")):
+        for location in locations[key]:
+            location_id = resolver.get_id(location["type"], location["name"])
+
+            if location_id is None:
+                not_found.append(location["name"])
+            else:
+                resolved[key].append((prefix + location["type"], location_id))
+                names[key].append(resolver.get_name(location["type"], location_id))
+
+    if len(not_found) > 0:
+        return JsonResponse(
+            {"error": "Locations not found: %s" % ", ".join(not_found)}, status=400
+        )
+
+    jumps, times = compute_distance_table(
+        settings_form.cleaned_data, resolved["sources"], resolved["targets"]
+    )
+
+    return JsonResponse(
+        {
+            "sources": names["sources"],
+            "targets": names["targets"],
+            "jumps": jumps,
+            "time": times,
+        }
+    )
+
+
+# a json api listing every system within a jump or travel time limit of an origin. the query string holds the same
+# fields as the path form for the origin and the route settings, plus either max_jumps or max_time in seconds
+# the response has a "systems" list ordered from the nearest system, where each system has its name, security and
+# either its "jumps" or its travel "time"
+# each system is measured along the route the path form would find to it. that route never enters an avoided system
+# and only crosses a penalized one when there is no other way, so a system behind penalized space is in range if the
+# route through it is short enough. the time is the same as the distance table api's: the time of every warp on the
+# route, with gate jumps taking no time
+def reachable_systems(request):
+
+    data = dict(route_query_defaults)
+    data.update(request.GET.dict())
+
+    range_form = RangeForm(data)
+    if not range_form.is_valid():
+        return JsonResponse({"errors": get_form_errors(range_form)}, status=400)
+
+    cleaned_data = range_form.cleaned_data
+    distances = compute_reachable_systems(
+        cleaned_data,
+        cleaned_data["origin_type"],
+        cleaned_data["origin_id"],
+        cleaned_data["max_jumps"],
+        cleaned_data["max_time"],
+    )
+
+    if cleaned_data["max_jumps"] is not None:
+        distance_name = "jumps"
+    else:
+        distance_name = "time"
+
+    systems = []
+    for system_id, distance in sorted(distances.items(), key=lambda item: item[1]):
+        systems.append(
+            {
+                "name": gate_manager.get_system_name(system_id),
+                "security": gate_manager.get_system_security(system_id),
+                distance_name: distance,
+            }
+        )
+
+    return JsonResponse({"systems": systems})
@@ -0,0 +1,294 @@
+import heapq
+import math
+
+import numpy
+
+from math_utils.graph import CompactGraph
+
+# witness searches give up after settling this many nodes. giving up early is always safe, it only means
+# that a shortcut is added when it might not have been needed
+witness_settle_limit = 500
+
+
+# a contraction hierarchy over a graph with symmetric edge costs
+# every node has a rank, and each node only stores its "upward" edges, which lead to higher ranked nodes. some
+# of these are shortcut edges that stand in for a path through a lower ranked middle node
+class ContractionHierarchy:
+    def __init__(self, upward, middles):
+        # csr graph of upward edges, weighted by cost
+        self.upward = upward
+
+        # for each upward edge, the index of the node the shortcut passes through, or -1 for an original edge
+        self.middles = middles
+
+    # returns (cost, path), where path is the list of node indices on the cheapest path from any of the source
+    # nodes to any of the target nodes. returns (inf, []) if none of the targets can be reached
+    # stats is an optional dict. if supplied, the number of settled nodes is stored under "expanded"
+    def query(self, source_indices, target_indices, stats=None):
+
+        # both searches only ever move upward, and meet at the highest ranked node on the shortest path
+        forward = _UpwardSearch(self.upward, source_indices)
+        backward = _UpwardSearch(self.upward, target_indices)
+
+        best_cost = math.inf
+        meeting_node = None
+
+        while True:
+            forward_key = forward.next_cost()
+            backward_key = backward.next_cost()
+
+            if min(forward_key, backward_key) >= best_cost:
+                break
+
+            if forward_key <= backward_key:
+                search, other = forward, backward
+            else:
+                search, other = backward, forward
+
+            node = search.settle_next()
+
+            if node is not None and node in other.costs:
+                cost = search.costs[node] + other.costs[node]
+                if cost < best_cost:
+                    best_cost = cost
+                    meeting_node = node
+
+        if stats is not None:
+            stats["expanded"] = len(forward.costs) + len(backward.costs)
+
+        if meeting_node is None:
+            return math.inf, []
+
+        # walk down from the meeting node to the source, then from the meeting node to the target
+        path = [meeting_node]
+        self._unpack_chain(forward.parents, meeting_node, path)
+        path.reverse()
+        self._unpack_chain(backward.parents, meeting_node, path)
+
+        return best_cost, path
+
+    def to_arrays(self):
+        return {
+            "offsets": self.upward.offsets,
+            "targets": self.upward.targets,
+            "costs": self.upward.weights,
+            "middles": self.middles,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(
+            CompactGraph(arrays["offsets"], arrays["targets"], arrays["costs"]),
+            arrays["middles"],
+        )
+
+    # follows the parent links of one of the upward searches from the node down to its start node, appending
+    # every node of the unpacked path to the path list
+    def _unpack_chain(self, parents, node, path):
+        parent = parents[node]
+
+        while parent is not None:
+            self._unpack_edge(node, parent, path)
+            node = parent
+            parent = parents[node]
+
+    # appends the nodes of the original path represented by the edge between origin and target to the path list,
+    # excluding the origin itself
+    def _unpack_edge(self, origin, target, path):
+        stack = [(origin, target)]
+
+        while len(stack) > 0:
+            origin, target = stack.pop()
+            middle = self._edge_middle(origin, target)
+
+            if middle < 0:
+                path.append(target)
+            else:
+                stack.append((middle, target))
+                stack.append((origin, middle))
+
+    # the edge between two nodes is stored as an upward edge of whichever one has the lower rank
+    def _edge_middle(self, a, b):
+        try:
+            edge = self.upward.edge_index(a, b)
+        except KeyError:
+            edge = self.upward.edge_index(b, a)
+
+        return int(self.middles[edge])
+
+
+# contracts the graph one node at a time, from least to most important, adding shortcut edges that preserve the
+# shortest path costs between the remaining nodes. edge_costs is parallel to the graph's edge arrays and must be
+# symmetric. returns a ContractionHierarchy
+def contract_graph(graph, edge_costs):
+    node_count = graph.node_count
+
+    # adjacency of the graph that remains to be contracted: node -> {neighbor: (cost, middle node)}
+    adjacency = [dict() for i in range(node_count)]
+    for origin, target, cost in zip(
+        graph.edge_origins().tolist(), graph.targets.tolist(), edge_costs.tolist()
+    ):
+        existing = adjacency[origin].get(target)
+        if origin != target and (existing is None or cost < existing[0]):
+            adjacency[origin][target] = (cost, -1)
+            adjacency[target][origin] = (cost, -1)
+
+    # nodes next to many contracted nodes are pushed back, which spreads the contraction evenly over the graph
+    contracted_neighbors = [0] * node_count
+
+    def importance(node, shortcuts):
+        return len(shortcuts) - len(adjacency[node]) + contracted_neighbors[node]
+
+    queue = []
+    for node in range(node_count):
+        queue.append((importance(node, _find_shortcuts(adjacency, node)), node))
+    heapq.heapify(queue)
+
+    up_origins = []
+    up_targets = []
+    up_costs = []
+    up_middles = []
+
+    while len(queue) > 0:
+        priority, node = heapq.heappop(queue)
+
+        # priorities go stale as the graph changes, so recompute this one before contracting it
+        shortcuts = _find_shortcuts(adjacency, node)
+        priority = importance(node, shortcuts)
+        if len(queue) > 0 and priority > queue[0][0]:
+            heapq.heappush(queue, (priority, node))
+            continue
+
+        # every neighbor that remains will be contracted later, so these edges all lead upward
+        for neighbor, (cost, middle) in adjacency[node].items():
+            up_origins.append(node)
+            up_targets.append(neighbor)
+            up_costs.append(cost)
+            up_middles.append(middle)
+
+            del adjacency[neighbor][node]
+            contracted_neighbors[neighbor] += 1
+
+        for a, b, cost in shortcuts:
+            existing = adjacency[a].get(b)
+            if existing is None or cost < existing[0]:
+                adjacency[a][b] = (cost, node)
+                adjacency[b][a] = (cost, node)
+
+        adjacency[node] = dict()
+
+    order = numpy.lexsort((up_targets, up_origins))
+    offsets = numpy.zeros(node_count + 1, dtype=numpy.int64)
+    numpy.cumsum(
+        numpy.bincount(
+            numpy.asarray(up_origins, dtype=numpy.int32), minlength=node_count
+        ),
+        out=offsets[1:],
+    )
+
+    upward = CompactGraph(
+        offsets,
+        numpy.asarray(up_targets, dtype=numpy.int32)[order],
+        numpy.asarray(up_costs, dtype=numpy.float64)[order],
+    )
+
+    return ContractionHierarchy(
+        upward, numpy.asarray(up_middles, dtype=numpy.int32)[order]
+    )
+
+
+# returns a list of (a, b, cost) shortcuts needed to preserve shortest paths if the node is removed
+# a shortcut between two neighbors is only needed if no other path (a witness) is at least as cheap
+def _find_shortcuts(adjacency, node):
+    neighbors = list(adjacency[node].items())
+    shortcuts = []
+
+    for i, (a, (cost_a, middle_a)) in enumerate(neighbors):
+
+        # collect the neighbors that can't be reached more cheaply by an existing direct edge
+        via_costs = dict()
+        for b, (cost_b, middle_b) in neighbors[i + 1 :]:
+            via_cost = cost_a + cost_b
+            existing = adjacency[a].get(b)
+
+            if existing is None or existing[0] > via_cost:
+                via_costs[b] = via_cost
+
+        if len(via_costs) == 0:
+            continue
+
+        witness_costs = _witness_search(
+            adjacency, a, node, via_costs, max(via_costs.values())
+        )
+
+        for b, via_cost in via_costs.items():
+            if witness_costs.get(b, math.inf) > via_cost:
+                shortcuts.append((a, b, via_cost))
+
+    return shortcuts
+
+
+# a bounded dijkstra search from start that never passes through the excluded node
+# returns the best known cost to each of the reached nodes, which is an upper bound on the true cost
+def _witness_search(adjacency, start, excluded, targets, max_cost):
+    costs = {start: 0}
+    open_set = [(0, start)]
+    settled = set()
+    remaining = len(targets)
+
+    while len(open_set) > 0 and len(settled) < witness_settle_limit:
+        cost, node = heapq.heappop(open_set)
+
+        if cost > max_cost:
+            break
+
+        if node in settled:
+            continue
+
+        settled.add(node)
+        if node in targets:
+            remaining -= 1
+            if remaining == 0:
+                break
+
+        for neighbor, (edge_cost, middle) in adjacency[node].items():
+            if neighbor != excluded:
+                neighbor_cost = cost + edge_cost
+                if neighbor_cost < costs.get(neighbor, math.inf):
+                    costs[neighbor] = neighbor_cost
+                    heapq.heappush(open_set, (neighbor_cost, neighbor))
+
+    return costs
+
+
+# one direction of a contraction hierarchy query: a dijkstra search that only follows upward edges
+class _UpwardSearch:
+    def __init__(self, upward, start_indices):
+        self.upward = upward
+        self.costs = dict()
+        self.parents = dict()
+        self.open_set = [(0, index, None) for index in start_indices]
+        heapq.heapify(self.open_set)
+
+    def next_cost(self):
+        if len(self.open_set) == 0:
+            return math.inf
+
+        return self.open_set[0][0]
+
+    # settles the next node in the open set and returns it, or None if it was already settled
+    def settle_next(self):
+        cost, node, parent = heapq.heappop(self.open_set)
+
+        if node in self.costs:
+            return None
+
+        self.costs[node] = cost
+        self.parents[node] = parent
+
+        targets, edge_costs = self.upward.neighbors(node)
+        for target, edge_cost in zip(targets.tolist(), edge_costs.tolist()):
+            if target not in self.costs:
+                heapq.heappush(self.open_set, (cost + edge_cost, target, node))
+
+        return node
@@ -0,0 +1,67 @@
+import numpy
+from scipy import sparse
+
+
+# a compact, array-backed directed graph stored in compressed sparse row (csr) form
+# nodes are dense integer indices from 0 to node_count - 1. the outgoing edges of node i are stored in
+# positions offsets[i]:offsets[i + 1] of the targets and weights arrays, sorted by target index
+class CompactGraph:
+    def __init__(self, offsets, targets, weights):
+        self.offsets = offsets
+        self.targets = targets
+        self.weights = weights
+
+    # build a graph from parallel arrays of edge origins, edge targets and edge weights
+    @classmethod
+    def from_edges(cls, node_count, origins, targets, weights):
+        origins = numpy.asarray(origins, dtype=numpy.int32)
+        targets = numpy.asarray(targets, dtype=numpy.int32)
+        weights = numpy.asarray(weights, dtype=numpy.float64)
+
+        # sort by origin first and target second, so each row can be binary searched
+        order = numpy.lexsort((targets, origins))
+
+        offsets = numpy.zeros(node_count + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(origins, minlength=node_count), out=offsets[1:])
+
+        return cls(offsets, targets[order], weights[order])
+
+    @property
+    def node_count(self):
+        return len(self.offsets) - 1
+
+    @property
+    def edge_count(self):
+        return len(self.targets)
+
+    # returns the start and end positions of the edges leaving the given node
+    def edge_range(self, index):
+        return int(self.offsets[index]), int(self.offsets[index + 1])
+
+    # returns the target indices and weights of the edges leaving the given node, as array views
+    def neighbors(self, index):
+        start, end = self.edge_range(index)
+        return self.targets[start:end], self.weights[start:end]
+
+    # returns the position of the edge from origin to target in the edge arrays
+    def edge_index(self, origin, target):
+        start, end = self.edge_range(origin)
+        position = start + numpy.searchsorted(self.targets[start:end], target)
+
+        if position == end or self.targets[position] != target:
+            raise KeyError((origin, target))
+
+        return int(position)
+
+    # returns a scipy sparse matrix sharing this graph's structure, holding the given per edge values
+    def to_matrix(self, edge_values):
+        return sparse.csr_matrix(
+            (edge_values, self.targets, self.offsets),
+            shape=(self.node_count, self.node_count),
+        )
+
+    # returns the origin index of every edge, parallel to the targets array
+    def edge_origins(self):
+        return numpy.repeat(
+            numpy.arange(self.node_count, dtype=numpy.int32), numpy.diff(self.offsets)
+        )
@@ -0,0 +1,82 @@
+import os
+
+import numpy
+from scipy.sparse import csgraph
+
+
+# an all pairs table of the minimum number of jumps between systems, stored in a .npy file and memory mapped so
+# that every process reading it shares the same pages through the os page cache
+class JumpMatrix:
+    def __init__(self, system_ids, matrix):
+        self.system_ids = system_ids
+        self.matrix = matrix
+        self.system_index = {
+            system_id: index for index, system_id in enumerate(system_ids.tolist())
+        }
+
+        # unreachable pairs are stored as the largest value of the matrix's data type
+        self.unreachable = numpy.iinfo(matrix.dtype).max
+
+    @classmethod
+    def load(cls, matrix_path, systems_path):
+        return cls(numpy.load(systems_path), numpy.load(matrix_path, mmap_mode="r"))
+
+    # returns the minimum number of jumps from system a to system b, or None if b can't be reached from a
+    def jumps(self, a, b):
+        value = int(self.matrix[self.system_index[a], self.system_index[b]])
+        return None if value == self.unreachable else value
+
+    # returns an array with the minimum number of jumps from the given system to every system, indexed like
+    # system_ids. unreachable systems hold the unreachable value
+    def jumps_from(self, a):
+        return self.matrix[self.system_index[a]]
+
+
+# computes the jump matrix for the given system adjacency matrix (a scipy sparse matrix where any stored entry is
+# a gate connection) and writes it to matrix_path, with the matching system ids written to systems_path
+# the matrix is computed a block of rows at a time, so the full table is never held as floats in memory
+def write_jump_matrix(matrix_path, systems_path, system_ids, adjacency, block_size=256):
+    system_count = len(system_ids)
+    wide_unreachable = numpy.iinfo(numpy.uint16).max
+
+    blocks = []
+    max_jumps = 0
+    for start in range(0, system_count, block_size):
+        block = csgraph.shortest_path(
+            adjacency,
+            unweighted=True,
+            indices=numpy.arange(start, min(start + block_size, system_count)),
+        )
+
+        is_reachable = numpy.isfinite(block)
+        if is_reachable.any():
+            max_jumps = max(max_jumps, int(block[is_reachable].max()))
+
+        blocks.append(
+            numpy.where(is_reachable, block, wide_unreachable).astype(numpy.uint16)
+        )
+
+    # use a single byte per entry whenever the longest route allows it
+    dtype = numpy.uint8 if max_jumps < numpy.iinfo(numpy.uint8).max else numpy.uint16
+    unreachable = numpy.iinfo(dtype).max
+
+    temp_path = matrix_path + ".tmp"
+    output = numpy.lib.format.open_memmap(
+        temp_path, mode="w+", dtype=dtype, shape=(system_count, system_count)
+    )
+
+    row = 0
+    for block in blocks:
+        output[row : row + len(block)] = numpy.where(
+            block == wide_unreachable, unreachable, block
+        )
+        row += len(block)
+
+    output.flush()
+    del output
+
+    with open(systems_path + ".tmp", "wb") as f:
+        numpy.save(f, numpy.asarray(system_ids, dtype=numpy.int64))
+
+    os.replace(systems_path + ".tmp", systems_path)
+    os.replace(temp_path, matrix_path)
@@ -0,0 +1,51 @@
+import numpy
+from scipy.sparse import csgraph
+
+
+# selects landmarks for the alt (a*, landmarks, triangle inequality) heuristic using farthest point selection
+# cost_matrix is a scipy sparse matrix of edge costs. the graph must be symmetric, so that the cost from a node to a
+# landmark is the same as the cost from the landmark to the node
+# returns an array of landmark indices and a (landmark, node) array of exact shortest path costs
+def select_landmarks(cost_matrix, landmark_count, first_index=0):
+
+    # the first landmark is the node farthest from an arbitrary starting node, which tends to land on the map edge
+    start_costs = csgraph.dijkstra(cost_matrix, indices=first_index)
+    candidate = _farthest_node(start_costs)
+
+    landmarks = []
+    distances = []
+    nearest_landmark = numpy.full(cost_matrix.shape[0], numpy.inf)
+
+    for i in range(min(landmark_count, cost_matrix.shape[0])):
+        landmark_costs = csgraph.dijkstra(cost_matrix, indices=candidate)
+
+        landmarks.append(candidate)
+        distances.append(landmark_costs)
+
+        # each following landmark is the node farthest from all of the landmarks chosen so far
+        numpy.minimum(nearest_landmark, landmark_costs, out=nearest_landmark)
+        candidate = _farthest_node(nearest_landmark)
+
+    return numpy.array(landmarks, dtype=numpy.int32), numpy.array(distances)
+
+
+# given the landmark cost table and the indices of a set of target nodes, returns an array containing a lower
+# bound on the cost from every node to the nearest target. by the triangle inequality, for any landmark l and target t:
+#   cost(v, t) >= cost(v, l) - cost(t, l)
+#   cost(v, t) >= cost(t, l) - cost(v, l)
+# for a set of targets, the nearest target can't be closer than the bound computed against the extreme targets
+def landmark_bounds(distances, target_indices):
+    target_distances = distances[:, target_indices]
+    nearest = target_distances.min(axis=1)[:, numpy.newaxis]
+    farthest = target_distances.max(axis=1)[:, numpy.newaxis]
+
+    bounds = numpy.fmax(distances - farthest, nearest - distances)
+    bounds = numpy.fmax.reduce(bounds, axis=0)
+
+    # a landmark that neither the node nor the targets can reach gives inf - inf. fmax skips the nan, so a node
+    # without any usable landmark gets a bound of 0
+    return numpy.fmax(bounds, 0)
+
+
+def _farthest_node(costs):
+    return int(numpy.argmax(numpy.where(numpy.isfinite(costs), costs, -1)))
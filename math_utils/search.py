@@ -1,12 +1,26 @@
 import heapq
+import math
+from collections import OrderedDict
+from collections import deque
+
+import numpy
+
 
 # performs a uniform cost search (dijkstra's algorithm)
 # start states is an iterable of states where the search should be gin
 # goal_func takes a state and returns True if this is a goal state, false otherwise
 # neighbor_func takes a state and returns an iterable of tuples containing a state and a cost to move to that state
-def uniform_cost_search(start_states, goal_func, neighbor_func):
+# stats is an optional dict. if supplied, the number of expanded states is stored under "expanded"
+def uniform_cost_search(start_states, goal_func, neighbor_func, stats=None):
+    return astar_search(start_states, goal_func, neighbor_func, _zero_heuristic, stats)
+
 
-    open_set = list((0, s, None) for s in start_states)
+# performs an a* search. the arguments are the same as uniform_cost_search, plus:
+# heuristic_func takes a state and returns a lower bound on the cost from that state to the nearest goal state
+# as long as the heuristic never overestimates and is consistent, the resulting path costs the same as the uniform cost search
+def astar_search(start_states, goal_func, neighbor_func, heuristic_func, stats=None):
+
+    open_set = list((heuristic_func(s), 0, s, None) for s in start_states)
     heapq.heapify(open_set)
 
     closed_set = dict()
@@ -14,7 +28,7 @@ def uniform_cost_search(start_states, goal_func, neighbor_func):
     final_state = None
 
     while len(open_set) > 0:
-        cost, state, parent = heapq.heappop(open_set)
+        estimate, cost, state, parent = heapq.heappop(open_set)
 
         if state not in closed_set:
             closed_set[state] = parent
@@ -25,7 +39,259 @@ def uniform_cost_search(start_states, goal_func, neighbor_func):
 
             for neighbor, neighbor_cost in neighbor_func(state):
                 if neighbor not in closed_set:
-                    heapq.heappush(open_set, (cost + neighbor_cost, neighbor, state))
+                    neighbor_cost += cost
+                    heapq.heappush(
+                        open_set,
+                        (
+                            neighbor_cost + heuristic_func(neighbor),
+                            neighbor_cost,
+                            neighbor,
+                            state,
+                        ),
+                    )
+
+    if stats is not None:
+        stats["expanded"] = len(closed_set)
+
+    return _trace_parents(closed_set, final_state)
+
+
+# performs a bidirectional uniform cost search, growing one search forward from the start states and another
+# backward from the goal states until they meet in the middle
+# goal_states is a collection of the states where the search can end
+# neighbor_func is the same as for uniform_cost_search
+# reverse_neighbor_func takes a state and returns an iterable of tuples containing a state from which that state can
+# be reached, and the cost to move from there to the given state
+# stats is an optional dict. if supplied, the number of expanded states is stored under "expanded"
+def bidirectional_search(
+    start_states, goal_states, neighbor_func, reverse_neighbor_func, stats=None
+):
+
+    forward = _SearchFrontier(start_states, neighbor_func)
+    backward = _SearchFrontier(goal_states, reverse_neighbor_func)
+
+    best_cost = math.inf
+    meeting_state = None
+
+    for state in forward.costs:
+        if state in backward.costs:
+            best_cost = 0
+            meeting_state = state
+
+    # once the cheapest states left on the two frontiers add up to the best known path, no better path can exist
+    while forward.next_cost() + backward.next_cost() < best_cost:
+
+        if forward.next_cost() <= backward.next_cost():
+            frontier, other = forward, backward
+        else:
+            frontier, other = backward, forward
+
+        for state, cost in frontier.expand_next():
+            if state in other.costs and cost + other.costs[state] < best_cost:
+                best_cost = cost + other.costs[state]
+                meeting_state = state
+
+    if stats is not None:
+        stats["expanded"] = len(forward.closed_set) + len(backward.closed_set)
+
+    if meeting_state is None:
+        return []
+
+    result = _trace_parents(forward.parents, meeting_state)
+    current_state = backward.parents[meeting_state]
+    while current_state is not None:
+        result.append(current_state)
+        current_state = backward.parents[current_state]
+
+    return result
+
+
+# a uniform cost search that can be resumed. the settled states are kept between calls, so one tree grown from a
+# set of start states can answer queries for many different goals, only expanding further when none of the
+# goal states has been settled yet
+class SearchTree:
+    def __init__(self, start_states, neighbor_func):
+        self.neighbor_func = neighbor_func
+
+        # map from each settled state to its cost and to the state it was reached from
+        self.costs = dict()
+        self.parents = dict()
+
+        self.open_set = list((0, s, None) for s in start_states)
+        heapq.heapify(self.open_set)
+
+    # returns the cheapest goal state, expanding the tree until one is settled. returns None if none of the goal
+    # states can be reached. goal_states should support fast membership tests, such as a set
+    def search(self, goal_states):
+        final_state = None
+        for state in goal_states:
+            if state in self.costs and (
+                final_state is None or self.costs[state] < self.costs[final_state]
+            ):
+                final_state = state
+
+        # every state that is still open costs at least as much as the settled ones, so a settled goal is the best
+        if final_state is not None:
+            return final_state
+
+        while len(self.open_set) > 0:
+            state = self.settle_next()
+
+            if state is not None and state in goal_states:
+                return state
+
+        return None
+
+    # returns the path from the start states to the cheapest goal state, in the same form as uniform_cost_search
+    def find_path(self, goal_states):
+        return _trace_parents(self.parents, self.search(goal_states))
+
+    # settles the next state in the open set and returns it, or returns None if it had already been settled
+    def settle_next(self):
+        cost, state, parent = heapq.heappop(self.open_set)
+
+        if state in self.costs:
+            return None
+
+        self.costs[state] = cost
+        self.parents[state] = parent
+
+        for neighbor, neighbor_cost in self.neighbor_func(state):
+            if neighbor not in self.costs:
+                heapq.heappush(self.open_set, (cost + neighbor_cost, neighbor, state))
+
+        return state
+
+
+# finds the cheapest cost from the start states of each search tree to each group of goal states. each tree is only
+# expanded until a state from every goal group has been settled, or until there is nothing left to expand, and
+# paths can be read from the trees afterwards
+# returns the table of costs, with a row for each tree and a column for each goal group. goals that can't be
+# reached cost infinity. the table is a list of lists, or a 2d numpy array if as_array is set
+def cost_table(trees, goal_groups, as_array=False):
+
+    costs = list()
+    for tree in trees:
+        row = list()
+
+        for goal_states in goal_groups:
+            state = tree.search(goal_states)
+            row.append(math.inf if state is None else tree.costs[state])
+
+        costs.append(row)
+
+    if as_array:
+        costs = numpy.array(costs, dtype=float).reshape(len(trees), len(goal_groups))
+
+    return costs
+
+
+# performs a uniform cost search from the start states, measuring a second quantity, such as a distance or a
+# time, along the cheapest path to each state
+# neighbor_func takes a state and returns an iterable of tuples containing a state, the cost to move to that state
+# and the amount the measure grows by when moving there, which must not be negative
+# returns an ordered dict mapping each settled state to the measure of its cheapest path, from the cheapest state to
+# the most expensive. a state measuring more than max_measure can be included. the measure never shrinks along a
+# path, so the search stops once every path left to follow measures more than max_measure
+def measured_search(start_states, neighbor_func, max_measure):
+
+    measures = OrderedDict()
+    open_set = list((0, 0, s) for s in start_states)
+    heapq.heapify(open_set)
+
+    # the number of entries in the open set that are within the limit
+    open_count = len(open_set)
+
+    while open_count > 0:
+        cost, measure, state = heapq.heappop(open_set)
+
+        if measure <= max_measure:
+            open_count -= 1
+
+        if state in measures:
+            continue
+
+        measures[state] = measure
+
+        # states over the limit are still expanded, since a cheaper path through them would be over it as well
+        for neighbor, neighbor_cost, neighbor_measure in neighbor_func(state):
+            if neighbor not in measures:
+                neighbor_measure += measure
+                heapq.heappush(
+                    open_set, (cost + neighbor_cost, neighbor_measure, neighbor)
+                )
+
+                if neighbor_measure <= max_measure:
+                    open_count += 1
+
+    return measures
+
+
+# performs a breadth first search over every state reachable from the start states
+# returns a dict mapping each reached state to the number of steps needed to get there
+def breadth_first_depths(start_states, neighbor_func):
+
+    depths = {s: 0 for s in start_states}
+    open_set = deque(depths)
+
+    while len(open_set) > 0:
+        state = open_set.popleft()
+        depth = depths[state] + 1
+
+        for neighbor in neighbor_func(state):
+            if neighbor not in depths:
+                depths[neighbor] = depth
+                open_set.append(neighbor)
+
+    return depths
+
+
+def _zero_heuristic(state):
+    return 0
+
+
+# one direction of a bidirectional search. costs and parents hold the best known cost and parent of every state
+# reached so far, including states that haven't been expanded yet
+class _SearchFrontier:
+    def __init__(self, start_states, neighbor_func):
+        self.neighbor_func = neighbor_func
+        self.costs = {s: 0 for s in start_states}
+        self.parents = {s: None for s in self.costs}
+        self.closed_set = set()
+        self.open_set = [(0, s) for s in self.costs]
+        heapq.heapify(self.open_set)
+
+    # returns the cost of the cheapest state that hasn't been expanded, or infinity if there are none left
+    def next_cost(self):
+        while len(self.open_set) > 0 and self.open_set[0][1] in self.closed_set:
+            heapq.heappop(self.open_set)
+
+        if len(self.open_set) == 0:
+            return math.inf
+
+        return self.open_set[0][0]
+
+    # expands the cheapest state in the open set and returns a list of (state, cost) for each neighbor whose
+    # best known cost was improved
+    def expand_next(self):
+        cost, state = heapq.heappop(self.open_set)
+        self.closed_set.add(state)
+
+        improved = list()
+        for neighbor, neighbor_cost in self.neighbor_func(state):
+            neighbor_cost += cost
+
+            if neighbor_cost < self.costs.get(neighbor, math.inf):
+                self.costs[neighbor] = neighbor_cost
+                self.parents[neighbor] = state
+                heapq.heappush(self.open_set, (neighbor_cost, neighbor))
+                improved.append((neighbor, neighbor_cost))
+
+        return improved
+
+
+# follow the parent links stored by a search back from the final state
+def _trace_parents(parents, final_state):
 
     # if the final state is not none, we have found a path
     result = list()
@@ -34,7 +300,7 @@ def uniform_cost_search(start_states, goal_func, neighbor_func):
 
         while current_state is not None:
             result.append(current_state)
-            current_state = closed_set[current_state]
+            current_state = parents[current_state]
 
         result.reverse()
 
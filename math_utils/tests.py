@@ -0,0 +1,421 @@
+import itertools
+import math
+import random
+import unittest
+
+import numpy
+from scipy import integrate
+from scipy import optimize
+from scipy import sparse
+from scipy.sparse import csgraph
+
+from math_utils import contraction
+from math_utils import landmarks
+from math_utils import search
+from math_utils import tour
+from math_utils import travel_time
+from math_utils.union_find import UnionFind
+from math_utils.graph import CompactGraph
+
+
+# builds a random directed graph, returning a dict mapping each node to a dict of {neighbor: cost}
+def random_graph(rng, node_count, edge_count):
+    edges = {node: dict() for node in range(node_count)}
+
+    for i in range(edge_count):
+        origin = rng.randrange(node_count)
+        target = rng.randrange(node_count)
+
+        if origin != target:
+            edges[origin][target] = rng.randint(1, 20)
+
+    return edges
+
+
+# returns the shortest path cost from each node to every node, found with scipy's dijkstra
+def shortest_costs(edges):
+    origins = [a for a in edges for b in edges[a]]
+    targets = [b for a in edges for b in edges[a]]
+    costs = [edges[a][b] for a in edges for b in edges[a]]
+
+    matrix = sparse.csr_matrix(
+        (costs, (origins, targets)), shape=(len(edges), len(edges))
+    )
+    return csgraph.dijkstra(matrix)
+
+
+# returns the cost of following a path through the graph, checking that every step is an edge
+def path_cost(test, edges, path):
+    total = 0
+    for (a, b) in zip(path, path[1:]):
+        test.assertIn(b, edges[a])
+        total += edges[a][b]
+
+    return total
+
+
+class AstarSearchTest(unittest.TestCase):
+    def test_matches_dijkstra(self):
+        rng = random.Random(2)
+
+        for i in range(100):
+            edges = random_graph(rng, 30, 80)
+            all_costs = shortest_costs(edges)
+
+            start_states = set(rng.sample(range(30), 2))
+            goal_states = set(rng.sample(range(30), 2))
+            expected = min(all_costs[a][b] for a in start_states for b in goal_states)
+
+            # half of the exact cost to the nearest goal never overestimates and is consistent
+            def heuristic_func(state):
+                return 0.5 * min(all_costs[state][b] for b in goal_states)
+
+            def neighbor_func(state):
+                return edges[state].items()
+
+            path = search.astar_search(
+                start_states, goal_states.__contains__, neighbor_func, heuristic_func
+            )
+
+            if math.isinf(expected):
+                self.assertEqual(path, [])
+            else:
+                self.assertIn(path[0], start_states)
+                self.assertIn(path[-1], goal_states)
+                self.assertEqual(path_cost(self, edges, path), expected)
+
+            # the uniform cost search is the same search with no heuristic
+            path = search.uniform_cost_search(
+                start_states, goal_states.__contains__, neighbor_func
+            )
+            if not math.isinf(expected):
+                self.assertEqual(path_cost(self, edges, path), expected)
+
+
+class LandmarkBoundsTest(unittest.TestCase):
+    def test_disconnected_graph(self):
+        # two separate pairs of nodes: 0 - 1 and 2 - 3
+        cost_matrix = sparse.csr_matrix(
+            (numpy.ones(4), ([0, 1, 2, 3], [1, 0, 3, 2])), shape=(4, 4)
+        )
+        landmark_indices, distances = landmarks.select_landmarks(cost_matrix, 2)
+
+        bounds = landmarks.landmark_bounds(distances, [0])
+
+        self.assertFalse(numpy.isnan(bounds).any())
+        self.assertEqual(bounds[0], 0)
+        self.assertLessEqual(bounds[1], 1)
+
+        # the bounds never overestimate, so nodes that can't reach the target may only be bounded by infinity or 0
+        for index in (2, 3):
+            self.assertTrue(bounds[index] == 0 or math.isinf(bounds[index]))
+
+    def test_unreachable_landmark(self):
+        # the first landmark can't be reached by nodes 0 and 1, the second can't be reached by node 2
+        distances = numpy.array([[numpy.inf, numpy.inf, 0.0], [0.0, 1.0, numpy.inf]])
+
+        bounds = landmarks.landmark_bounds(distances, [1])
+
+        self.assertFalse(numpy.isnan(bounds).any())
+        self.assertEqual(bounds.tolist(), [1.0, 0.0, numpy.inf])
+
+    def test_no_usable_landmark(self):
+        distances = numpy.array([[numpy.inf, numpy.inf]])
+
+        bounds = landmarks.landmark_bounds(distances, [1])
+
+        self.assertEqual(bounds.tolist(), [0.0, 0.0])
+
+
+class BidirectionalSearchTest(unittest.TestCase):
+    def test_matches_dijkstra(self):
+        rng = random.Random(3)
+
+        for i in range(100):
+            edges = random_graph(rng, 30, 80)
+            all_costs = shortest_costs(edges)
+
+            reverse_edges = {node: dict() for node in edges}
+            for a in edges:
+                for b, cost in edges[a].items():
+                    reverse_edges[b][a] = cost
+
+            start_states = set(rng.sample(range(30), 2))
+            goal_states = set(rng.sample(range(30), 2))
+            expected = min(all_costs[a][b] for a in start_states for b in goal_states)
+
+            path = search.bidirectional_search(
+                start_states,
+                goal_states,
+                lambda state: edges[state].items(),
+                lambda state: reverse_edges[state].items(),
+            )
+
+            if math.isinf(expected):
+                self.assertEqual(path, [])
+            else:
+                self.assertIn(path[0], start_states)
+                self.assertIn(path[-1], goal_states)
+                self.assertEqual(path_cost(self, edges, path), expected)
+
+    def test_start_is_goal(self):
+        path = search.bidirectional_search({1, 2}, {2, 3}, lambda s: [], lambda s: [])
+
+        self.assertEqual(path, [2])
+
+
+class MeasuredSearchTest(unittest.TestCase):
+    def test_matches_dijkstra(self):
+        rng = random.Random(9)
+
+        for i in range(100):
+            edges = random_graph(rng, 30, 80)
+
+            # the costs are unique, so there is only one cheapest path to each node
+            for a in edges:
+                for b in edges[a]:
+                    edges[a][b] = rng.random() + 1
+
+            measures = {(a, b): rng.randint(0, 3) for a in edges for b in edges[a]}
+            all_costs = shortest_costs(edges)
+            start_states = set(rng.sample(range(30), 2))
+            max_measure = rng.randint(0, 8)
+
+            def neighbor_func(state):
+                return [
+                    (neighbor, cost, measures[(state, neighbor)])
+                    for (neighbor, cost) in edges[state].items()
+                ]
+
+            result = search.measured_search(start_states, neighbor_func, max_measure)
+            tree = search.SearchTree(start_states, lambda s: edges[s].items())
+
+            for state in range(30):
+                if math.isinf(min(all_costs[s][state] for s in start_states)):
+                    self.assertNotIn(state, result)
+                    continue
+
+                # add up the measure along the cheapest path to the state
+                path = tree.find_path({state})
+                expected = sum(measures[(a, b)] for (a, b) in zip(path, path[1:]))
+
+                if expected <= max_measure:
+                    self.assertEqual(result[state], expected)
+                elif state in result:
+                    self.assertGreater(result[state], max_measure)
+
+            # the states are ordered from the cheapest
+            costs = [min(all_costs[s][state] for s in start_states) for state in result]
+            self.assertEqual(costs, sorted(costs))
+
+
+class ContractionHierarchyTest(unittest.TestCase):
+    def test_matches_dijkstra(self):
+        rng = random.Random(4)
+
+        for i in range(50):
+            edges = random_graph(rng, 40, 70)
+
+            # the hierarchy needs symmetric costs, like the gates of the system graph
+            for a in edges:
+                for b, cost in list(edges[a].items()):
+                    edges[b][a] = cost
+
+            # one graph in two has unit costs, where many paths are equally cheap
+            if i % 2 == 0:
+                for a in edges:
+                    for b in edges[a]:
+                        edges[a][b] = 1
+
+            graph = CompactGraph.from_edges(
+                len(edges),
+                [a for a in edges for b in edges[a]],
+                [b for a in edges for b in edges[a]],
+                [edges[a][b] for a in edges for b in edges[a]],
+            )
+            hierarchy = contraction.contract_graph(graph, graph.weights)
+            all_costs = shortest_costs(edges)
+
+            for j in range(10):
+                source_indices = rng.sample(range(40), rng.randint(1, 2))
+                target_indices = rng.sample(range(40), rng.randint(1, 2))
+                expected = min(
+                    all_costs[a][b] for a in source_indices for b in target_indices
+                )
+
+                cost, path = hierarchy.query(source_indices, target_indices)
+
+                self.assertEqual(cost, expected)
+                if math.isinf(expected):
+                    self.assertEqual(path, [])
+                else:
+                    # the shortcuts are unpacked into the original edges
+                    self.assertIn(path[0], source_indices)
+                    self.assertIn(path[-1], target_indices)
+                    self.assertEqual(path_cost(self, edges, path), expected)
+
+
+class ApproachTimeTest(unittest.TestCase):
+    # the numerical solution compute_approach_time used before it was solved in closed form. the ship is never
+    # more than align_time behind a ship flying at max_speed from the start, which bounds the search. the old
+    # search started from -1 rather than 0, which failed for very short align times
+    def integrated_approach_time(self, travel_distance, max_speed, align_time):
+        inv_x = 1 / (align_time * 0.72135)
+
+        def remaining_distance(t):
+            result, error = integrate.quad(
+                lambda u: max_speed * (1 - math.exp(-u * inv_x)), 0, t
+            )
+            return result - travel_distance
+
+        return optimize.brentq(
+            remaining_distance, 0, travel_distance / max_speed + align_time, xtol=0.01
+        )
+
+    def test_matches_integration(self):
+        for travel_distance in (1000, 11000, 12500, 14000, 100000):
+            for max_speed in (50, 150, 1200):
+                for align_time in (0.5, 5, 30):
+                    expected = self.integrated_approach_time(
+                        travel_distance, max_speed, align_time
+                    )
+
+                    # the old search stopped within 0.01s of the answer
+                    self.assertAlmostEqual(
+                        travel_time.compute_approach_time(
+                            travel_distance, max_speed, align_time
+                        ),
+                        expected,
+                        delta=0.01,
+                    )
+
+
+class WarpTimesTest(unittest.TestCase):
+    def test_matches_scalar_warp_time(self):
+        # from a short warp between two gates up to crossing a large system, which covers both warps that
+        # reach max warp speed and ones that don't
+        distances = numpy.geomspace(1e8, 1e14, 200)
+
+        for warp_speed in (1.5, 3, 6, 10):
+            for max_speed in (100, 300):
+                max_warp_speed = travel_time.au * warp_speed
+
+                expected = [
+                    travel_time.compute_warp_time(d, max_speed, max_warp_speed)
+                    for d in distances.tolist()
+                ]
+
+                numpy.testing.assert_allclose(
+                    travel_time.compute_warp_times(
+                        distances, max_speed, max_warp_speed
+                    ),
+                    expected,
+                    rtol=1e-12,
+                )
+
+
+class TourTest(unittest.TestCase):
+    # returns a random matrix of asymmetric costs between count stops
+    def random_costs(self, rng, count):
+        return [
+            [0 if i == j else rng.randint(1, 100) for j in range(count)]
+            for i in range(count)
+        ]
+
+    def test_exact_tour_matches_brute_force(self):
+        rng = random.Random(5)
+
+        for stop_count in range(0, 7):
+            for i in range(10):
+                costs = self.random_costs(rng, stop_count + 2)
+                start, end = 0, stop_count + 1
+                stops = list(range(1, stop_count + 1))
+
+                expected = min(
+                    tour.tour_cost(costs, start, end, order)
+                    for order in itertools.permutations(stops)
+                )
+
+                order = tour.optimize_tour(costs, start, end)
+                self.assertEqual(sorted(order), stops)
+                self.assertEqual(tour.tour_cost(costs, start, end, order), expected)
+
+    def test_unreachable_stop(self):
+        costs = [[0, math.inf, 1], [math.inf, 0, math.inf], [1, math.inf, 0]]
+
+        self.assertEqual(tour.optimize_tour(costs, 0, 2), [1])
+
+    def test_improved_tour(self):
+        rng = random.Random(6)
+
+        # too many stops to solve exactly, so the local search is used
+        stop_count = tour.exact_stop_limit + 3
+        costs = self.random_costs(rng, stop_count + 2)
+        start, end = 0, stop_count + 1
+        stops = list(range(1, stop_count + 1))
+
+        order = tour.optimize_tour(costs, start, end)
+        self.assertEqual(sorted(order), stops)
+
+        # the local search starts from the nearest neighbor tour and only ever makes it cheaper
+        nearest_order = tour.nearest_neighbor_tour(costs, start, stops)
+        self.assertLessEqual(
+            tour.tour_cost(costs, start, end, order),
+            tour.tour_cost(costs, start, end, nearest_order),
+        )
+
+        # no single move improves the result any further
+        best_cost = tour.tour_cost(costs, start, end, order)
+        for candidate in tour._tour_moves(order):
+            self.assertGreaterEqual(
+                tour.tour_cost(costs, start, end, candidate), best_cost
+            )
+
+
+class UnionFindTest(unittest.TestCase):
+    def test_matches_connected_components(self):
+        rng = random.Random(7)
+
+        for i in range(50):
+            node_count = 60
+            pairs = [
+                (rng.randrange(node_count), rng.randrange(node_count))
+                for j in range(rng.randint(0, 80))
+            ]
+
+            node_sets = UnionFind(node_count)
+            for a, b in pairs:
+                node_sets.union(a, b)
+
+            matrix = sparse.csr_matrix(
+                (
+                    numpy.ones(len(pairs)),
+                    ([a for a, b in pairs], [b for a, b in pairs]),
+                ),
+                shape=(node_count, node_count),
+            )
+            component_count, labels = csgraph.connected_components(
+                matrix, directed=False
+            )
+
+            # two nodes share a root exactly when they are in the same component
+            roots = node_sets.roots()
+            self.assertEqual(len(set(roots.tolist())), component_count)
+            for a in range(node_count):
+                for b in range(node_count):
+                    self.assertEqual(roots[a] == roots[b], labels[a] == labels[b])
+
+            # each root holds the size of its set
+            for root in set(roots.tolist()):
+                self.assertEqual(node_sets.sizes[root], (roots == root).sum())
+
+    def test_union_returns_whether_merged(self):
+        node_sets = UnionFind(3)
+
+        self.assertTrue(node_sets.union(0, 1))
+        self.assertFalse(node_sets.union(1, 0))
+        self.assertNotEqual(node_sets.find(2), node_sets.find(0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+import math
+
+# tours with up to this many stops are solved exactly, larger ones use local search heuristics
+exact_stop_limit = 12
+
+
+# finds the cheapest order in which to visit every stop on a path from start to end
+# costs is a square matrix (a numpy array or a list of lists) where costs[i][j] is the cost of travelling from i
+# to j. costs don't have to be symmetric. returns the list of stop indices in visiting order, not including the
+# start and end
+def optimize_tour(costs, start, end):
+    stops = [i for i in range(len(costs)) if i != start and i != end]
+
+    if len(stops) <= exact_stop_limit:
+        return held_karp(costs, start, end, stops)
+
+    order = nearest_neighbor_tour(costs, start, stops)
+    return improve_tour(costs, start, end, order)
+
+
+# returns the total cost of visiting the stops in the given order, starting at start and finishing at end
+def tour_cost(costs, start, end, order):
+    total = 0
+    previous = start
+
+    for stop in order:
+        total += costs[previous][stop]
+        previous = stop
+
+    return total + costs[previous][end]
+
+
+# solves the tour exactly using the held-karp dynamic program, which takes O(2^n * n^2) time for n stops
+def held_karp(costs, start, end, stops):
+    stop_count = len(stops)
+
+    if stop_count == 0:
+        return []
+
+    # best[mask][j] is the cost of the cheapest path that starts at start, visits exactly the stops in mask and
+    # finishes at stops[j]. parent[mask][j] is the previous stop on that path, or -1 if it came from start
+    full_mask = (1 << stop_count) - 1
+    best = [[math.inf] * stop_count for mask in range(full_mask + 1)]
+    parent = [[-1] * stop_count for mask in range(full_mask + 1)]
+
+    for j in range(stop_count):
+        best[1 << j][j] = costs[start][stops[j]]
+
+    for mask in range(1, full_mask + 1):
+        for j in range(stop_count):
+            cost = best[mask][j]
+            if cost == math.inf or not mask & (1 << j):
+                continue
+
+            for k in range(stop_count):
+                if mask & (1 << k):
+                    continue
+
+                next_mask = mask | (1 << k)
+                next_cost = cost + costs[stops[j]][stops[k]]
+                if next_cost < best[next_mask][k]:
+                    best[next_mask][k] = next_cost
+                    parent[next_mask][k] = j
+
+    last = min(
+        range(stop_count), key=lambda j: best[full_mask][j] + costs[stops[j]][end]
+    )
+
+    # if some stops can't be reached at all, every order is equally bad
+    if best[full_mask][last] == math.inf:
+        return list(stops)
+
+    # walk the parent links back from the last stop
+    order = []
+    mask = full_mask
+    while last >= 0:
+        order.append(stops[last])
+        mask, last = mask & ~(1 << last), parent[mask][last]
+
+    order.reverse()
+    return order
+
+
+# builds a tour by always travelling to the cheapest stop that hasn't been visited yet
+def nearest_neighbor_tour(costs, start, stops):
+    remaining = set(stops)
+    order = []
+    current = start
+
+    while len(remaining) > 0:
+        current = min(remaining, key=lambda stop: costs[current][stop])
+        remaining.remove(current)
+        order.append(current)
+
+    return order
+
+
+# improves a tour with 2-opt moves (reversing a section of the tour) and or-opt moves (moving a run of up to three
+# consecutive stops to another position), until neither move finds an improvement
+def improve_tour(costs, start, end, order):
+    order = list(order)
+    best_cost = tour_cost(costs, start, end, order)
+
+    improved = True
+    while improved:
+        improved = False
+
+        for candidate in _tour_moves(order):
+            candidate_cost = tour_cost(costs, start, end, candidate)
+
+            if candidate_cost < best_cost:
+                order = candidate
+                best_cost = candidate_cost
+                improved = True
+                break
+
+    return order
+
+
+# generates every tour reachable from the given order with a single 2-opt or or-opt move
+def _tour_moves(order):
+    stop_count = len(order)
+
+    for i in range(stop_count - 1):
+        for j in range(i + 2, stop_count + 1):
+            yield order[:i] + order[i:j][::-1] + order[j:]
+
+    for length in (1, 2, 3):
+        for i in range(stop_count - length + 1):
+            segment = order[i : i + length]
+            rest = order[:i] + order[i + length :]
+
+            for j in range(len(rest) + 1):
+                if j != i:
+                    yield rest[:j] + segment + rest[j:]
@@ -1,30 +1,32 @@
+import functools
 import math
 import random
 
 import numpy
-from scipy import integrate
-from scipy import optimize
+from scipy import special
 
 au = 149597870700.0
 
 
+# returns the time taken to travel the given distance from a standstill, with the ship accelerating towards
+# max_speed as it aligns. the velocity at time t is
+#   v(t) = max_speed * (1 - exp(-t / k)), where k = align_time * 0.72135
+# integrating from 0 gives the position
+#   x(t) = max_speed * (t - k * (1 - exp(-t / k)))
+# writing u = t / k and a = travel_distance / (max_speed * k), x(t) = travel_distance becomes
+#   u - 1 + exp(-u) = a
+# which is solved exactly by the principal branch of the lambert w function
+#   u = a + 1 + W(-exp(-(a + 1)))
+# the same few ship profiles are used over and over, so the results are memoized
+@functools.lru_cache(maxsize=1024)
 def compute_approach_time(travel_distance, max_speed, align_time):
 
-    inv_x = 1 / (align_time * 0.72135)
+    k = align_time * 0.72135
+    a = travel_distance / (max_speed * k)
 
-    # return the velocity at time t
-    def velocity(t):
-        return max_speed * (1 - math.exp(-t * inv_x))
+    w = special.lambertw(-math.exp(-(a + 1))).real
 
-    # return the position at time t
-    # this is really hard to calculate directly so we'll just integrate velocity from 0
-    def remaining_distance(t):
-        (result, error) = integrate.quad(velocity, 0, t)
-        return result - travel_distance
-
-    return optimize.brentq(
-        remaining_distance, -1, travel_distance / max_speed * 2, xtol=0.01
-    )
+    return k * (a + 1 + w)
 
 
 def compute_warp_time(warp_distance, max_speed, max_warp_speed):
@@ -98,3 +100,62 @@ def compute_warp_time(warp_distance, max_speed, max_warp_speed):
         + decel_time
         - math.log(exit_velocity / decel_constant) / decel_constant
     )
+
+
+# a vectorized version of compute_warp_time, taking a numpy array of warp distances and returning an array of
+# warp times. both regimes are handled: warps long enough to reach the max warp speed, and shorter ones
+def compute_warp_times(warp_distances, max_speed, max_warp_speed):
+
+    warp_distances = numpy.asarray(warp_distances, dtype=numpy.float64)
+
+    max_warp_speed_au = max_warp_speed / au
+
+    accel_constant = max_warp_speed_au
+    decel_constant = min(max_warp_speed_au / 3, 2)
+
+    # compute the speed we'll need to accelerate up to if we ignore the max warp speed
+    speed = (
+        accel_constant
+        * decel_constant
+        * warp_distances
+        / (accel_constant + decel_constant)
+    )
+
+    exit_velocity = min(100, 0.5 * max_speed)
+
+    # when max warp speed is reached, accelerating and decelerating take a fixed time, and the rest of the
+    # distance is covered at max warp speed
+    acceleration_distance = (
+        (accel_constant + decel_constant)
+        * max_warp_speed
+        / (accel_constant * decel_constant)
+    )
+
+    capped_time = (
+        -math.log(
+            (accel_constant + decel_constant) / (acceleration_distance * decel_constant)
+        )
+        / accel_constant
+        - math.log(
+            (accel_constant + decel_constant) / (acceleration_distance * accel_constant)
+        )
+        / decel_constant
+        + (warp_distances - acceleration_distance) / max_warp_speed
+    )
+
+    # otherwise the whole warp is spent accelerating and decelerating
+    uncapped_time = (
+        -numpy.log(
+            (accel_constant + decel_constant) / (warp_distances * decel_constant)
+        )
+        / accel_constant
+        - numpy.log(
+            (accel_constant + decel_constant) / (warp_distances * accel_constant)
+        )
+        / decel_constant
+    )
+
+    return (
+        numpy.where(speed > max_warp_speed, capped_time, uncapped_time)
+        - math.log(exit_velocity / decel_constant) / decel_constant
+    )
@@ -0,0 +1,44 @@
+import array
+
+import numpy
+
+
+# a union-find (disjoint set) structure over dense integer ids from 0 to size - 1
+# the parent links and set sizes are kept in flat typed arrays, so each id only costs a few bytes
+class UnionFind:
+    def __init__(self, size):
+        self.parents = array.array("i", range(size))
+        self.sizes = array.array("i", [1]) * size
+
+    def __len__(self):
+        return len(self.parents)
+
+    # returns the root id of the set containing a, halving the path to the root as it goes
+    def find(self, a):
+        parents = self.parents
+
+        while parents[a] != a:
+            parents[a] = parents[parents[a]]
+            a = parents[a]
+
+        return a
+
+    # merges the sets containing a and b, returning False if they were already in the same set
+    def union(self, a, b):
+        a = self.find(a)
+        b = self.find(b)
+
+        if a == b:
+            return False
+
+        # attach the smaller set below the larger one, which keeps the trees shallow
+        if self.sizes[a] < self.sizes[b]:
+            a, b = b, a
+
+        self.parents[b] = a
+        self.sizes[a] += self.sizes[b]
+        return True
+
+    # returns an array holding the root id of every id's set
+    def roots(self):
+        return numpy.array([self.find(a) for a in range(len(self))], dtype=numpy.int32)
@@ -1,18 +1,165 @@
+import array
+import datetime
+import functools
 import math
+import os
+import shutil
+import time
+import uuid
 from collections import defaultdict
 
+import numpy
+from django.conf import settings
+from scipy import sparse
+
+from math_utils import contraction
+from math_utils import jumps
+from math_utils import landmarks
+from math_utils.graph import CompactGraph
+from static_dump.name_resolver import NameResolver
 from static_dump.models import MapSolarSystem, MapRegion, Station, GraphNode, GraphEdge
 
+# tables from before the landmark costs were lower bounds for every ship are left under their old name
+landmark_filename = "landmark_bounds.npz"
+version_filename = "dump_version.txt"
+jump_matrix_filename = "jump_matrix.npy"
+jump_systems_filename = "jump_matrix_systems.npy"
+system_hierarchy_filename = "system_hierarchy.npz"
+snapshot_prefix = "graph_snapshot_"
+
+# the arrays stored in a graph snapshot, each in its own .npy file so that it can be memory mapped
+snapshot_arrays = [
+    "node_ids",
+    "node_systems",
+    "node_security",
+    "offsets",
+    "targets",
+    "weights",
+    "system_ids",
+    "system_names",
+    "constellation_names",
+    "region_names",
+    "system_region_ids",
+    "station_ids",
+    "station_names",
+]
+
+
+# route indexes derived from the static dump are stored in files next to the database
+def get_index_path(filename):
+    return os.path.join(
+        os.path.dirname(settings.DATABASES["default"]["NAME"]), filename
+    )
+
+
+# write a set of named arrays to an index file. the file is written under a temporary name and then
+# moved into place, so a worker starting up never sees a partially written index
+def save_index(filename, **arrays):
+    path = get_index_path(filename)
+    temp_path = path + ".tmp"
+
+    with open(temp_path, "wb") as f:
+        numpy.savez(f, **arrays)
+
+    os.replace(temp_path, path)
+
+
+# load an index file, returning None if it has not been built
+def load_index(filename):
+    path = get_index_path(filename)
+
+    if not os.path.exists(path):
+        return None
+
+    with numpy.load(path) as index:
+        return {name: index[name] for name in index.files}
+
+
+# every import of the static dump is given a new version string. anything cached from the map data, such as
+# computed routes, should include the version in its key so that it is dropped when a new dump is imported
+def write_dump_version():
+    version = "%d-%s" % (time.time(), uuid.uuid4().hex[:8])
+
+    path = get_index_path(version_filename)
+    with open(path + ".tmp", "w") as f:
+        f.write(version)
+    os.replace(path + ".tmp", path)
+
+    return version
+
+
+# returns the version string of the imported static dump, or "0" if it was imported without a version
+def read_dump_version():
+    path = get_index_path(version_filename)
+
+    if not os.path.exists(path):
+        return "0"
+
+    with open(path) as f:
+        return f.read().strip()
+
+
+# returns the time the static dump was imported as a utc datetime, or None if it was imported without a version
+def read_dump_modified():
+    path = get_index_path(version_filename)
+
+    if not os.path.exists(path):
+        return None
+
+    return datetime.datetime.utcfromtimestamp(os.path.getmtime(path))
+
+
+# returns the gate warp manager shared by everything in this process, loading it the first time it is used
+@functools.lru_cache(maxsize=None)
+def get_gate_manager():
+    return GateWarpManager()
+
 
 # this class will query and manage relationships between systems, stored
 # by gate warp
 class GateWarpManager:
 
-    # map from node_id to system id
-    _nodes = dict()
+    # version of the static dump this manager was loaded from
+    _version = None
+
+    # array of node ids, indexed by the dense node index used by the graph
+    _node_ids = None
+
+    # map from node id to dense node index
+    _node_index = dict()
+
+    # arrays of system id and system security, indexed by dense node index
+    _node_systems = None
+    _node_security = None
+
+    # csr graph over dense node indices. the edge weight is the warp distance, or nan for a gate jump
+    _graph = None
+
+    # (landmark, node index) array of lower bounds on shortest path costs for any ship, or None if not built
+    _landmark_distances = None
+
+    # memory mapped all pairs table of system jump counts, or None if it hasn't been built
+    _jump_matrix = None
+
+    # contraction hierarchy over the condensed system graph, where every jump costs the same, or None if it
+    # hasn't been built
+    _system_hierarchy = None
+
+    # array of system ids, indexed by the dense system index used by the system hierarchy
+    _system_ids = None
+
+    # map from system id to dense system index
+    _system_index = dict()
 
-    # map from node id to dict: destination node id as key, distance as value
-    _edges = dict()
+    # map from system id to a list of system ids reachable by a single gate jump
+    _system_neighbors = dict()
+
+    # map from (origin system id, destination system id) to a list of (gate id, destination gate id) tuples, one
+    # for each gate connecting the two systems
+    _system_gates = dict()
+
+    # map from system id to its security level
+    _system_security = dict()
 
     # map from system id to system info: name, constellation name, region
     # name, sec status
@@ -21,38 +168,451 @@ class GateWarpManager:
     # map from station id to station name
     _stations = dict()
 
+    # map from system id to the id of its region
+    _system_regions = dict()
+
+    # map from system id to a list of the ids of the nodes in that system
+    _system_nodes = dict()
+
+    # resolves system, station and region names to ids, or None until it is first used
+    _name_resolver = None
+
     def __init__(self):
+        self._version = read_dump_version()
+
+        # a snapshot written by the import command is memory mapped, so the graph arrays are shared through
+        # the os page cache by every process that loads the same dump
+        if not self.load_snapshot():
+            self.load_database()
+
+        self._node_index = {
+            node_id: index for index, node_id in enumerate(self._node_ids.tolist())
+        }
+
+        self.build_system_graph()
+        self.load_landmarks()
+        self.load_jump_matrix()
+        self.load_system_hierarchy()
+
+    # load the nodes, edges, systems and stations from the database
+    def load_database(self):
         node_query = GraphNode.objects.values_list(
             "id", "system_id", "system__security_level"
-        )
-        self._nodes = {
-            node_id: (system_id, security)
-            for (node_id, system_id, security) in node_query
-        }
+        ).order_by("id")
+
+        node_ids = array.array("q")
+        node_systems = array.array("i")
+        node_security = array.array("d")
+        for (node_id, system_id, security) in node_query:
+            node_ids.append(node_id)
+            node_systems.append(system_id)
+            node_security.append(security)
+
+        self._node_ids = numpy.frombuffer(node_ids, dtype=numpy.int64)
+        self._node_systems = numpy.frombuffer(node_systems, dtype=numpy.int32)
+        self._node_security = numpy.frombuffer(node_security, dtype=numpy.float64)
 
+        # stream the edges into compact typed buffers instead of nested dicts
         edge_query = GraphEdge.objects.values_list(
             "origin_id", "destination_id", "distance"
         )
-        self._edges = defaultdict(dict)
+        origin_ids = array.array("q")
+        destination_ids = array.array("q")
+        distances = array.array("d")
         for (origin_id, destination_id, distance) in edge_query:
-            self._edges[origin_id][destination_id] = distance
+            origin_ids.append(origin_id)
+            destination_ids.append(destination_id)
+            distances.append(math.nan if distance is None else distance)
+
+        # the node ids are sorted, so a binary search maps them to their dense indices
+        self._graph = CompactGraph.from_edges(
+            len(self._node_ids),
+            numpy.searchsorted(self._node_ids, origin_ids),
+            numpy.searchsorted(self._node_ids, destination_ids),
+            distances,
+        )
 
         system_query = MapSolarSystem.objects.select_related(
             "constellation", "region"
-        ).values_list("id", "name", "constellation__name", "region__name")
+        ).values_list("id", "name", "constellation__name", "region__name", "region_id")
+        self._systems = dict()
+        self._system_regions = dict()
+        for (system_id, name, const_name, region_name, region_id) in system_query:
+            self._systems[system_id] = (name, const_name, region_name)
+            self._system_regions[system_id] = region_id
+
+        station_query = Station.objects.values_list("id", "name")
+        self._stations = {station_id: name for (station_id, name) in station_query}
+
+    # load the graph snapshot for the current dump version, returning False if it hasn't been written
+    def load_snapshot(self):
+        path = get_index_path(snapshot_prefix + self._version)
+
+        # snapshots written before an array was added are missing its file, and have to be rebuilt
+        if not all(
+            os.path.exists(os.path.join(path, name + ".npy"))
+            for name in snapshot_arrays
+        ):
+            return False
+
+        arrays = {
+            name: numpy.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+            for name in snapshot_arrays
+        }
+
+        self._node_ids = arrays["node_ids"]
+        self._node_systems = arrays["node_systems"]
+        self._node_security = arrays["node_security"]
+        self._graph = CompactGraph(
+            arrays["offsets"], arrays["targets"], arrays["weights"]
+        )
+
         self._systems = {
             system_id: (name, const_name, region_name)
-            for (system_id, name, const_name, region_name) in system_query
+            for (system_id, name, const_name, region_name) in zip(
+                arrays["system_ids"].tolist(),
+                arrays["system_names"].tolist(),
+                arrays["constellation_names"].tolist(),
+                arrays["region_names"].tolist(),
+            )
         }
+        self._system_regions = dict(
+            zip(arrays["system_ids"].tolist(), arrays["system_region_ids"].tolist())
+        )
+        self._stations = dict(
+            zip(arrays["station_ids"].tolist(), arrays["station_names"].tolist())
+        )
 
-        station_query = Station.objects.values_list("id", "name")
-        self._stations = {station_id: name for (station_id, name) in station_query}
+        return True
+
+    # write a snapshot of the loaded graph for the current dump version, and remove the snapshots of older
+    # versions. the snapshot is written to a temporary directory which is then moved into place
+    def write_snapshot(self):
+        system_ids = sorted(self._systems)
+        station_ids = sorted(self._stations)
+
+        arrays = {
+            "node_ids": self._node_ids,
+            "node_systems": self._node_systems,
+            "node_security": self._node_security,
+            "offsets": self._graph.offsets,
+            "targets": self._graph.targets,
+            "weights": self._graph.weights,
+            "system_ids": numpy.array(system_ids, dtype=numpy.int64),
+            "system_names": numpy.array(
+                [self._systems[s][0] for s in system_ids], dtype=str
+            ),
+            "constellation_names": numpy.array(
+                [self._systems[s][1] for s in system_ids], dtype=str
+            ),
+            "region_names": numpy.array(
+                [self._systems[s][2] for s in system_ids], dtype=str
+            ),
+            "system_region_ids": numpy.array(
+                [self._system_regions[s] for s in system_ids], dtype=numpy.int64
+            ),
+            "station_ids": numpy.array(station_ids, dtype=numpy.int64),
+            "station_names": numpy.array(
+                [self._stations[s] for s in station_ids], dtype=str
+            ),
+        }
+
+        path = get_index_path(snapshot_prefix + self._version)
+        temp_path = path + ".tmp"
+
+        shutil.rmtree(temp_path, ignore_errors=True)
+        os.makedirs(temp_path)
+        for name in snapshot_arrays:
+            numpy.save(os.path.join(temp_path, name + ".npy"), arrays[name])
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(temp_path, path)
+
+        # processes still using an old snapshot keep their mapping after its files are removed
+        index_directory = os.path.dirname(path)
+        for filename in os.listdir(index_directory):
+            if filename.startswith(snapshot_prefix) and filename != os.path.basename(
+                path
+            ):
+                shutil.rmtree(
+                    os.path.join(index_directory, filename), ignore_errors=True
+                )
+
+    # collapse the gate edges of the graph into the condensed system graph
+    def build_system_graph(self):
+        gate_edges = numpy.isnan(self._graph.weights)
+        gate_origins = self._graph.edge_origins()[gate_edges]
+        gate_targets = self._graph.targets[gate_edges]
+        self._system_gates = defaultdict(list)
+        for (origin_system, target_system, origin_id, target_id) in zip(
+            self._node_systems[gate_origins].tolist(),
+            self._node_systems[gate_targets].tolist(),
+            self._node_ids[gate_origins].tolist(),
+            self._node_ids[gate_targets].tolist(),
+        ):
+            self._system_gates[(origin_system, target_system)].append(
+                (origin_id, target_id)
+            )
+
+        self._system_neighbors = defaultdict(list)
+        for (origin_system, target_system) in self._system_gates:
+            self._system_neighbors[origin_system].append(target_system)
+
+        self._system_security = dict(
+            zip(self._node_systems.tolist(), self._node_security.tolist())
+        )
+
+        self._system_ids = numpy.array(sorted(self._systems), dtype=numpy.int64)
+        self._system_index = {
+            system_id: index
+            for index, system_id in enumerate(self._system_ids.tolist())
+        }
+
+        self._system_nodes = defaultdict(list)
+        for (node_id, system_id) in zip(
+            self._node_ids.tolist(), self._node_systems.tolist()
+        ):
+            self._system_nodes[system_id].append(node_id)
+
+    # load the landmark table written by the import command. a table built from a different set of nodes
+    # is stale and would give invalid bounds, so it is ignored
+    def load_landmarks(self):
+        index = load_index(landmark_filename)
+
+        if index is not None and numpy.array_equal(index["node_ids"], self._node_ids):
+            self._landmark_distances = index["distances"]
+        else:
+            self._landmark_distances = None
+
+    # choose landmarks and store the shortest path cost from every node to each of them
+    # edge_costs holds the cost of every graph edge, parallel to the graph's edge arrays
+    def build_landmarks(self, edge_costs, landmark_count):
+        landmark_indices, distances = landmarks.select_landmarks(
+            self._graph.to_matrix(edge_costs), landmark_count
+        )
+
+        save_index(
+            landmark_filename,
+            node_ids=self._node_ids,
+            landmark_ids=self._node_ids[landmark_indices],
+            distances=distances,
+        )
+        self._landmark_distances = distances
+
+    # memory map the jump matrix written by the import command, ignoring it if it was built for other systems
+    def load_jump_matrix(self):
+        matrix_path = get_index_path(jump_matrix_filename)
+        systems_path = get_index_path(jump_systems_filename)
+        self._jump_matrix = None
+
+        if os.path.exists(matrix_path) and os.path.exists(systems_path):
+            jump_matrix = jumps.JumpMatrix.load(matrix_path, systems_path)
+
+            if jump_matrix.system_ids.tolist() == sorted(self._systems):
+                self._jump_matrix = jump_matrix
+
+    # compute the minimum number of jumps between every pair of systems and write it to the jump matrix file
+    def build_jump_matrix(self):
+        system_ids = sorted(self._systems)
+        system_index = {system_id: i for i, system_id in enumerate(system_ids)}
+
+        origins = []
+        targets = []
+        for origin_system, neighbor_systems in self._system_neighbors.items():
+            for target_system in neighbor_systems:
+                origins.append(system_index[origin_system])
+                targets.append(system_index[target_system])
+
+        adjacency = sparse.csr_matrix(
+            (numpy.ones(len(origins)), (origins, targets)),
+            shape=(len(system_ids), len(system_ids)),
+        )
+
+        jumps.write_jump_matrix(
+            get_index_path(jump_matrix_filename),
+            get_index_path(jump_systems_filename),
+            system_ids,
+            adjacency,
+        )
+        self.load_jump_matrix()
+
+    def get_jump_matrix(self):
+        return self._jump_matrix
+
+    # load the system hierarchy written by the import command. a hierarchy built for another version of the dump
+    # may be missing shortcuts for changed gates, so it is ignored
+    def load_system_hierarchy(self):
+        index = load_index(system_hierarchy_filename)
+
+        if index is not None and str(index["version"]) == self._version:
+            self._system_hierarchy = contraction.ContractionHierarchy.from_arrays(index)
+        else:
+            self._system_hierarchy = None
+
+    # contract the condensed system graph, with each gate connection costing one jump, and write the hierarchy
+    # to the system hierarchy file
+    def build_system_hierarchy(self):
+        origins = []
+        targets = []
+        for origin_system, neighbor_systems in self._system_neighbors.items():
+            for target_system in neighbor_systems:
+                origins.append(self._system_index[origin_system])
+                targets.append(self._system_index[target_system])
+
+        system_graph = CompactGraph.from_edges(
+            len(self._system_ids), origins, targets, numpy.ones(len(origins))
+        )
+        hierarchy = contraction.contract_graph(system_graph, system_graph.weights)
+
+        save_index(
+            system_hierarchy_filename,
+            version=numpy.array(self._version),
+            **hierarchy.to_arrays()
+        )
+        self._system_hierarchy = hierarchy
+
+    # finds the path with the fewest jumps between the sets of systems using the system hierarchy. returns the
+    # list of system ids on the path, in the same form as uniform_cost_search, or None if the hierarchy is not
+    # available. if stats is a dict, the number of systems settled by the query is stored in stats["expanded"]
+    def find_system_hierarchy_path(
+        self, origin_systems, destination_systems, stats=None
+    ):
+        if self._system_hierarchy is None:
+            return None
+
+        cost, path = self._system_hierarchy.query(
+            [self._system_index[s] for s in origin_systems],
+            [self._system_index[s] for s in destination_systems],
+            stats,
+        )
+
+        return self._system_ids[path].tolist()
+
+    # returns a list, indexed by node index, of lower bounds on the cost for any ship to the nearest
+    # destination state. returns None if the landmark table is not available
+    def get_landmark_bounds(self, destination_states):
+        if self._landmark_distances is None:
+            return None
+
+        target_indices = [self._node_index[s] for s in destination_states]
+        return landmarks.landmark_bounds(
+            self._landmark_distances, target_indices
+        ).tolist()
+
+    def get_version(self):
+        return self._version
+
+    def get_graph(self):
+        return self._graph
+
+    def get_index(self, node_id):
+        return self._node_index[node_id]
+
+    def get_node_id(self, index):
+        return int(self._node_ids[index])
 
     def get_node(self, node_id):
-        return self._nodes[node_id]
+        index = self._node_index[node_id]
+        return int(self._node_systems[index]), float(self._node_security[index])
+
+    # returns a list of (neighbor id, distance) tuples, where the distance is None for a gate jump
+    # if edge_costs is supplied, each edge's entry in edge_costs is returned in place of its distance
+    def get_neighbors(self, current_state, edge_costs=None):
+        start, end = self._graph.edge_range(self._node_index[current_state])
+        neighbor_ids = self._node_ids[self._graph.targets[start:end]].tolist()
+
+        if edge_costs is not None:
+            return list(zip(neighbor_ids, edge_costs[start:end].tolist()))
+
+        return [
+            (node_id, None if math.isnan(distance) else distance)
+            for node_id, distance in zip(
+                neighbor_ids, self._graph.weights[start:end].tolist()
+            )
+        ]
+
+    def get_system_neighbors(self, system_id):
+        return self._system_neighbors.get(system_id, [])
+
+    def get_system_security(self, system_id):
+        return self._system_security[system_id]
+
+    # returns the ids of the nodes in the given system
+    def get_system_nodes(self, system_id):
+        return self._system_nodes.get(system_id, [])
+
+    def get_system_name(self, system_id):
+        return self._systems[system_id][0]
+
+    def get_system_region(self, system_id):
+        return self._system_regions[system_id]
+
+    # returns the name resolver built from the loaded systems and stations
+    def get_name_resolver(self):
+        if self._name_resolver is None:
+            self._name_resolver = NameResolver(
+                self._systems, self._system_regions, self._stations
+            )
+
+        return self._name_resolver
+
+    # expands a path through the condensed system graph back into a list of states, in the same form as
+    # uniform_cost_search. the path starts at one of the origin states, takes a gate into each system of
+    # system_path in turn and finishes at one of the destination states in the last system
+    def expand_system_path(self, system_path, origin_states, destination_states):
+        if len(system_path) == 0:
+            return []
+
+        # prefer starting at a gate that is on the route, so that no warp is needed to reach it
+        start_system = system_path[0]
+        if len(system_path) > 1:
+            departure_gates = {
+                gate_id
+                for (gate_id, destination_id) in self._system_gates[
+                    (start_system, system_path[1])
+                ]
+            }
+            start_states = origin_states & departure_gates
+        else:
+            start_states = set()
+
+        if len(start_states) == 0:
+            start_states = {
+                s for s in origin_states if self.get_node(s)[0] == start_system
+            }
+
+        path = [min(start_states)]
+
+        for (origin_system, target_system) in zip(system_path, system_path[1:]):
+            gates = self._system_gates[(origin_system, target_system)]
+            gate_id, destination_id = next(
+                (gate for gate in gates if gate[0] == path[-1]), gates[0]
+            )
+
+            if gate_id != path[-1]:
+                path.append(gate_id)
+            path.append(destination_id)
+
+        # warp from the last gate to the destination, unless the gate is a destination already
+        if path[-1] not in destination_states:
+            path.append(
+                min(
+                    s
+                    for s in destination_states
+                    if self.get_node(s)[0] == system_path[-1]
+                )
+            )
+
+        return path
+
+    # returns the warp distance between two adjacent nodes, or None if they are connected by a gate
+    def get_distance(self, origin_state, destination_state):
+        edge = self._graph.edge_index(
+            self._node_index[origin_state], self._node_index[destination_state]
+        )
+        distance = float(self._graph.weights[edge])
 
-    def get_neighbors(self, current_state):
-        return list(self._edges[current_state].items())
+        return None if math.isnan(distance) else distance
 
     def trace_path(self, state_list):
 
@@ -66,7 +626,7 @@ class GateWarpManager:
             prev_state = state_list[0]
 
         for current_state in state_list[1:]:
-            distance = self._edges[prev_state][current_state]
+            distance = self.get_distance(prev_state, current_state)
 
             # on the first element, we want to add the entry no matter what. on
             # subsequent entries we only want to add some of them
@@ -88,7 +648,7 @@ class GateWarpManager:
         path = []
         for destination_node, distance in (tuple(entry) for entry in action_list):
 
-            system_id, security = self._nodes[destination_node]
+            system_id, security = self.get_node(destination_node)
             location_name, constellation_name, region_name = self._systems[system_id]
 
             # if the destination is actually a station, overwrite the location name
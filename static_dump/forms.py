@@ -1,89 +1,82 @@
 from django import forms
 
-from static_dump.models import MapSolarSystem, MapRegion, Station
+from static_dump import dump_manager
 
 
-class SystemNameField(forms.CharField):
-    def clean(self, value):
-        value = super(SystemNameField, self).clean(value)
+# names are checked against the name resolver of the shared gate warp manager, so validating a form doesn't
+# need the database
+def get_name_resolver():
+    return dump_manager.get_gate_manager().get_name_resolver()
 
-        if value:
-            if MapSolarSystem.objects.filter(name=value).count() == 0:
-                raise forms.ValidationError("Solar system '%s' not found" % (value))
 
-        return value
+# returns the kind of location held by a form field such as origin_system or destination_region
+def get_location_kind(field_name):
+    return field_name.split("_", 1)[1]
+
 
+# a field holding the name of a single system, station or region. the name is matched ignoring case, and the
+# cleaned value is the name as it is written in the static dump
+class LocationNameField(forms.CharField):
+    kind = None
+    not_found_message = None
 
-class MultiSystemNameField(forms.CharField):
     def clean(self, value):
-        value = super(MultiSystemNameField, self).clean(value)
+        value = super(LocationNameField, self).clean(value)
 
         if value:
-            value_list = [v.strip() for v in value.split(",")]
-            found_set = {
-                n.lower()
-                for n in MapSolarSystem.objects.filter(name__in=value_list).values_list(
-                    "name", flat=True
-                )
-            }
-
-            not_found = list()
+            resolver = get_name_resolver()
+            object_id = resolver.get_id(self.kind, value)
 
-            for v in value_list:
-                if v.lower() not in found_set:
-                    not_found.append(v)
+            if object_id is None:
+                raise forms.ValidationError(self.not_found_message % (value))
 
-            if len(not_found) > 0:
-                raise forms.ValidationError(
-                    "Solar system(s) not found: %s" % (", ".join(not_found))
-                )
+            value = resolver.get_name(self.kind, object_id)
 
         return value
 
 
-class StationNameField(forms.CharField):
+# a field holding a comma separated list of names, cleaned the same way as LocationNameField
+class MultiLocationNameField(forms.CharField):
+    kind = None
+    not_found_message = None
+
     def clean(self, value):
-        value = super(StationNameField, self).clean(value)
+        value = super(MultiLocationNameField, self).clean(value)
 
         if value:
-            if Station.objects.filter(name=value).count() == 0:
-                raise forms.ValidationError("Station '%s' not found" % (value))
-        return value
+            resolver = get_name_resolver()
+            object_ids, not_found = resolver.get_ids(self.kind, value)
 
+            if len(not_found) > 0:
+                raise forms.ValidationError(
+                    self.not_found_message % (", ".join(not_found))
+                )
 
-class RegionNameField(forms.CharField):
-    def clean(self, value):
-        super(RegionNameField, self).clean(value)
-
-        if value:
-            if MapRegion.objects.filter(name=value).count() == 0:
-                raise forms.ValidationError("Region '%s' not found" % (value))
+            value = ", ".join(resolver.get_name(self.kind, i) for i in object_ids)
 
         return value
 
 
-class MultiRegionNameField(forms.CharField):
-    def clean(self, value):
-        super(MultiRegionNameField, self).clean(value)
+class SystemNameField(LocationNameField):
+    kind = "system"
+    not_found_message = "Solar system '%s' not found"
 
-        if value:
-            value_list = [v.strip() for v in value.split(",")]
-            found_set = {
-                n.lower()
-                for n in MapRegion.objects.filter(name__in=value_list).values_list(
-                    "name", flat=True
-                )
-            }
 
-            not_found = list()
+class MultiSystemNameField(MultiLocationNameField):
+    kind = "system"
+    not_found_message = "Solar system(s) not found: %s"
 
-            for v in value_list:
-                if v.lower() not in found_set:
-                    not_found.append(v)
 
-            if len(not_found) > 0:
-                raise forms.ValidationError(
-                    "Region(s) not found: %s" % (", ".join(not_found))
-                )
+class StationNameField(LocationNameField):
+    kind = "station"
+    not_found_message = "Station '%s' not found"
 
-        return value
+
+class RegionNameField(LocationNameField):
+    kind = "region"
+    not_found_message = "Region '%s' not found"
+
+
+class MultiRegionNameField(MultiLocationNameField):
+    kind = "region"
+    not_found_message = "Region(s) not found: %s"
@@ -0,0 +1,87 @@
+import bisect
+import json
+
+from static_dump import dump_manager
+
+# the largest number of names returned for one prefix
+suggestion_limit = 20
+
+# the serialized suggestions for every prefix up to this long are computed when an index is built. these are the
+# queries sent most often, since the autocomplete fields start asking after two or three characters
+precomputed_prefix_length = 3
+
+
+# a sorted array of names that answers case insensitive prefix searches with a binary search
+# lookup maps each lowercase name to an id, and names maps each id to its name. these are the tables kept by the
+# name resolver, so the index only holds references to the strings it already loaded
+class PrefixIndex:
+    def __init__(self, lookup, names):
+        self.keys = sorted(lookup)
+        self.names = [names[lookup[key]] for key in self.keys]
+
+        # map from a short lowercase prefix to the json serialized list of names starting with it
+        self.precomputed = dict()
+        for key in self.keys:
+            for length in range(1, min(len(key), precomputed_prefix_length) + 1):
+                prefix = key[:length]
+
+                if prefix not in self.precomputed:
+                    self.precomputed[prefix] = serialize_names(self.search(prefix))
+
+    def __len__(self):
+        return len(self.names)
+
+    # returns the names starting with the given prefix, ignoring case, in alphabetical order
+    # at most limit names are returned, or every match if limit is None
+    def search(self, prefix, limit=suggestion_limit):
+        prefix = prefix.lower()
+        start = bisect.bisect_left(self.keys, prefix)
+
+        # every key starting with the prefix sorts before the prefix followed by the last unicode character
+        end = bisect.bisect_left(self.keys, prefix + "\U0010ffff", start)
+
+        if limit is not None:
+            end = min(end, start + limit)
+
+        return self.names[start:end]
+
+    # returns the result of search as a json list, reusing the precomputed text for short prefixes
+    def search_json(self, prefix):
+        text = self.precomputed.get(prefix.lower())
+
+        if text is None:
+            text = serialize_names(self.search(prefix))
+
+        return text
+
+
+def serialize_names(names):
+    return json.dumps(names, separators=(",", ":"))
+
+
+# the prefix indexes for one process, along with the version and import time of the dump they were built from
+class NameIndexes:
+    def __init__(self):
+        self.gate_manager = dump_manager.get_gate_manager()
+        self.version = self.gate_manager.get_version()
+        self.modified = dump_manager.read_dump_modified()
+
+        # map from kind to the prefix index over its names
+        self.indexes = dict()
+
+    # returns the prefix index over the names of the given kind, which is "system", "station" or "region"
+    # the index is built from the names held by the shared gate warp manager's name resolver the first time it is
+    # used. the static data only changes when a dump is imported, so each index is built once
+    def get(self, kind):
+        if kind not in self.indexes:
+            resolver = self.gate_manager.get_name_resolver()
+            self.indexes[kind] = PrefixIndex(resolver.ids[kind], resolver.names[kind])
+
+        return self.indexes[kind]
+
+
+name_indexes = NameIndexes()
+
+
+def get_name_index(kind):
+    return name_indexes.get(kind)
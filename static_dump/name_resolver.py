@@ -0,0 +1,66 @@
+from collections import defaultdict
+
+
+# resolves system, station and region names to their ids without touching the database. names are matched
+# ignoring case and surrounding whitespace
+class NameResolver:
+    def __init__(self, systems, system_regions, stations):
+        # systems maps a system id to (name, constellation name, region name)
+        self.system_names = {
+            system_id: name
+            for (system_id, (name, const_name, region_name)) in systems.items()
+        }
+        self.station_names = dict(stations)
+        self.region_names = {
+            system_regions[system_id]: region_name
+            for (system_id, (name, const_name, region_name)) in systems.items()
+        }
+
+        self.region_systems = defaultdict(list)
+        for (system_id, region_id) in system_regions.items():
+            self.region_systems[region_id].append(system_id)
+
+        # map from kind to a map from lowercase name to id
+        self.ids = {
+            "system": self.make_lookup(self.system_names),
+            "station": self.make_lookup(self.station_names),
+            "region": self.make_lookup(self.region_names),
+        }
+
+        # map from kind to a map from id to name
+        self.names = {
+            "system": self.system_names,
+            "station": self.station_names,
+            "region": self.region_names,
+        }
+
+    def make_lookup(self, names):
+        return {name.lower(): object_id for (object_id, name) in names.items()}
+
+    # returns the id of the named system, station or region, or None if there is no such name
+    # kind is "system", "station" or "region"
+    def get_id(self, kind, name):
+        return self.ids[kind].get(name.strip().lower())
+
+    # returns the name of a system, station or region, with the capitalization used by the static dump
+    def get_name(self, kind, object_id):
+        return self.names[kind][object_id]
+
+    # returns a list of ids for the comma separated names, and a list of the names that weren't found
+    def get_ids(self, kind, value):
+        found = []
+        not_found = []
+
+        for name in value.split(","):
+            object_id = self.get_id(kind, name)
+
+            if object_id is None:
+                not_found.append(name.strip())
+            else:
+                found.append(object_id)
+
+        return found, not_found
+
+    # returns the ids of the systems in the given region
+    def get_region_systems(self, region_id):
+        return self.region_systems.get(region_id, [])
@@ -0,0 +1,50 @@
+import json
+import random
+
+from django.test import TestCase
+
+
+class PrefixIndexTest(TestCase):
+    def setUp(self):
+        rng = random.Random(8)
+
+        # names in mixed case that share many prefixes, like the system names of the static dump
+        self.names = dict()
+        for object_id in range(300):
+            self.names[object_id] = "".join(
+                rng.choice("aAbB-1 ") for i in range(rng.randint(1, 6))
+            )
+
+        # the lowercase lookup table kept by the name resolver
+        self.lookup = {
+            name.lower(): object_id for (object_id, name) in self.names.items()
+        }
+
+    # returns the names starting with the prefix by scanning every name, in the order the index uses
+    def scan(self, prefix, limit):
+        keys = sorted(key for key in self.lookup if key.startswith(prefix.lower()))
+        names = [self.names[self.lookup[key]] for key in keys]
+
+        return names if limit is None else names[:limit]
+
+    def test_matches_scan(self):
+        # the index builds its precomputed suggestions from the shared gate manager's module, so it is only
+        # imported once the test database is in place
+        from static_dump.name_index import PrefixIndex, suggestion_limit
+
+        index = PrefixIndex(self.lookup, self.names)
+        self.assertEqual(len(index), len(self.lookup))
+
+        prefixes = {key[:length] for key in self.lookup for length in range(5)}
+        prefixes.update(["c", "A-", "bBb", "\U0010ffff"])
+
+        for prefix in prefixes:
+            for casing in (prefix, prefix.upper()):
+                self.assertEqual(index.search(casing, None), self.scan(prefix, None))
+                self.assertEqual(
+                    index.search(casing), self.scan(prefix, suggestion_limit)
+                )
+                self.assertEqual(
+                    json.loads(index.search_json(casing)),
+                    self.scan(prefix, suggestion_limit),
+                )
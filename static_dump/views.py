@@ -1,65 +1,64 @@
+import hashlib
 import json
 
+from django.conf import settings
 from django.http import HttpResponse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 
-from static_dump.models import MapSolarSystem, MapRegion, Station
+from static_dump.name_index import get_name_index, name_indexes
 
 
-def system_name_autocomplete(request):
+# autocomplete responses only depend on the query and the imported dump, so the etag is derived from the two
+def autocomplete_etag(request):
+    text = "%s\n%s" % (name_indexes.version, request.GET.get("query", ""))
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
 
-    if "query" in request.GET:
-        search_text = request.GET["query"]
-        search_results = list(
-            MapSolarSystem.objects.filter(name__startswith=search_text)
-            .order_by("name")
-            .values_list("name", flat=True)
-        )
-    else:
-        search_text = ""
-        search_results = []
 
-    response_text = json.dumps(
-        {"query": search_text, "suggestions": search_results}, separators=(",", ":")
-    )
+def autocomplete_last_modified(request):
+    return name_indexes.modified
 
-    return HttpResponse(response_text)
 
+# the cache headers are added outside of the condition decorator, so the 304 responses it makes when a client
+# revalidates carry the same max age as the full responses
+autocomplete_cache_control = cache_control(
+    public=True, max_age=settings.AUTOCOMPLETE_CACHE_SECONDS
+)
 
-def station_name_autocomplete(request):
 
-    if "query" in request.GET:
-        search_text = request.GET["query"]
-        search_results = list(
-            Station.objects.filter(name__startswith=search_text)
-            .order_by("name")
-            .values_list("name", flat=True)
-        )
-    else:
-        search_text = ""
-        search_results = []
+@autocomplete_cache_control
+@condition(etag_func=autocomplete_etag, last_modified_func=autocomplete_last_modified)
+def system_name_autocomplete(request):
+    return autocomplete_response(request, "system")
 
-    response_text = json.dumps(
-        {"query": search_text, "suggestions": search_results}, separators=(",", ":")
-    )
 
-    return HttpResponse(response_text)
+@autocomplete_cache_control
+@condition(etag_func=autocomplete_etag, last_modified_func=autocomplete_last_modified)
+def station_name_autocomplete(request):
+    return autocomplete_response(request, "station")
 
 
+@autocomplete_cache_control
+@condition(etag_func=autocomplete_etag, last_modified_func=autocomplete_last_modified)
 def region_name_autocomplete(request):
+    return autocomplete_response(request, "region")
+
+
+# answers an autocomplete request with the names of the given kind that start with the query, using the in
+# memory name index rather than the database
+def autocomplete_response(request, kind):
 
     if "query" in request.GET:
         search_text = request.GET["query"]
-        search_results = list(
-            MapRegion.objects.filter(name__startswith=search_text)
-            .order_by("name")
-            .values_list("name", flat=True)
-        )
+        suggestions_text = get_name_index(kind).search_json(search_text)
     else:
         search_text = ""
-        search_results = []
+        suggestions_text = "[]"
 
-    response_text = json.dumps(
-        {"query": search_text, "suggestions": search_results}, separators=(",", ":")
+    # the suggestion list is often precomputed, so it is spliced into the response rather than serialized again
+    response_text = '{"query":%s,"suggestions":%s}' % (
+        json.dumps(search_text),
+        suggestions_text,
     )
 
-    return HttpResponse(response_text)
+    return HttpResponse(response_text, content_type="application/json")